@@ -1,25 +1,47 @@
+import copy
 import os
 import tempfile
 import uuid
-from typing import Tuple
+from typing import Optional, Tuple
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
 from yt_dlp import YoutubeDL
 
+from config import AUDIO_FORMATS, CREDENTIAL_CONFIG, DEFAULT_ENCODER_PROFILE, YT_DLP_CONFIG
+from encoding import ProcessGroup, can_copy, resolve_profile, run_ffmpeg, transcode, transcode_segmented
+from retry import (
+    BLOCKING_ERRORS,
+    FATAL,
+    NETWORK,
+    RETRY_POLICIES,
+    THROTTLED,
+    CircuitOpenError,
+    backoff_delay,
+    breaker_snapshots,
+    classify_error,
+    extractor_key,
+    get_breaker,
+)
+
 
 app = Flask(__name__, static_folder='static', static_url_path='')
 
 
+_FORMAT_ALIASES = {
+    "audio/mpeg": "mp3",
+    "aac": "m4a",
+    "audio/mp4": "m4a",
+    "ogg": "opus",
+    "audio/ogg": "opus",
+}
+
+
 def get_audio_mime_and_ext(format_name: str) -> Tuple[str, str]:
     normalized = (format_name or "").strip().lower()
-    if normalized in ("mp3", "audio/mpeg"):
-        return "audio/mpeg", "mp3"
-    if normalized in ("m4a", "aac", "audio/mp4"):
-        return "audio/mp4", "m4a"
-    if normalized in ("opus", "ogg", "audio/ogg"):
-        return "audio/ogg", "opus"
+    normalized = _FORMAT_ALIASES.get(normalized, normalized)
     # default
-    return "audio/mpeg", "mp3"
+    fmt = AUDIO_FORMATS.get(normalized) or AUDIO_FORMATS["mp3"]
+    return fmt["mime_type"], fmt["extension"]
 
 
 @app.route("/")
@@ -34,32 +56,22 @@ def download_audio():
 
     if not video_url:
         return jsonify({"error": "missing 'url' query parameter"}), 400
+    if _DRAINING.is_set():
+        return jsonify({"error": "server is shutting down, retry on another instance"}), 503, {"Retry-After": "5"}
 
     mime_type, audio_ext = get_audio_mime_and_ext(requested_format)
+    # 编码预设与异步任务一致：default / music / voice
+    profile = request.args.get("profile", default=DEFAULT_ENCODER_PROFILE, type=str)
+    try:
+        resolve_profile(audio_ext, profile)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    _record_request(video_url)
 
     temp_dir = tempfile.mkdtemp(prefix="yt_audio_")
-    base_name = f"{uuid.uuid4()}"
-    # yt-dlp will append proper extension after post-processing
-    output_template = os.path.join(temp_dir, base_name + ".%(ext)s")
-
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        "format": "bestaudio/best",
-        "outtmpl": output_template,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": audio_ext,
-                "preferredquality": "192",
-            }
-        ],
-    }
-
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            title = info.get("title") or "audio"
+        # yt-dlp 只下载原始音频流，编码由 encoding.py 按预设完成
+        audio_path, title = _download_audio(video_url, audio_ext, temp_dir, [], profile=profile)
     except Exception as exc:
         return jsonify({
             "error": "failed to download or process audio",
@@ -67,20 +79,6 @@ def download_audio():
             "hint": "确保已安装 ffmpeg，例如: brew install ffmpeg",
         }), 500
 
-    # After post-processing, the file should be base_name + .<audio_ext>
-    audio_path = os.path.join(temp_dir, base_name + f".{audio_ext}")
-    if not os.path.exists(audio_path):
-        # Fallback: search for any produced file
-        produced = [
-            os.path.join(temp_dir, f)
-            for f in os.listdir(temp_dir)
-            if f.startswith(base_name + ".")
-        ]
-        if produced:
-            audio_path = produced[0]
-        else:
-            return jsonify({"error": "audio file not found after processing"}), 500
-
     download_name = f"{title}.{audio_ext}"
 
     return send_file(
@@ -97,31 +95,311 @@ def download_audio():
 # -------------------------
 # 异步任务实现
 # -------------------------
+import hashlib
+import json
+import re
+import shutil
+import signal
 import threading
 import time
+from collections import deque
 from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from yt_dlp.utils import DownloadCancelled
+
+from credentials import CredentialPool, cookie_paths
+from storage import LocalStorage, create_storage
+from webhooks import WebhookDispatcher, valid_callback_url
 
 _TASKS = {}
 _TASKS_LOCK = threading.Lock()
 _TASK_TTL_SECONDS = 1800  # 30 分钟
 _CLEAN_INTERVAL_SECONDS = 60
 
+# 并发下载槽位：超出的任务保持 queued 状态等待。下载以网络等待为主，默认为 CPU 数的两倍
+_MAX_CONCURRENT_TASKS = int(os.environ.get("MAX_CONCURRENT_TASKS", max(2, (os.cpu_count() or 1) * 2)))
+_CANCEL_EVENTS = {}  # task_id -> threading.Event
+_TASK_PROCESSES = {}  # task_id -> encoding.ProcessGroup，任务启动的 ffmpeg 进程，取消时直接终止
+
+# 调度：任务分派前先只取元数据（时长、文件大小）估算耗时，空闲槽位按
+# “估算耗时 - 已等待时间 × 老化系数” 从小到大分配（短任务优先，长任务等待越久优先级越高）。
+# 长任务最多占用 槽位数 - 1 个槽位，始终给短任务留一个
+_SCHED_COND = threading.Condition(_TASKS_LOCK)
+_SCHED_QUEUE = {}  # task_id -> {"cost", "long", "enqueued_at"}，等待槽位的任务
+_SCHED_RUNNING = {}  # task_id -> 是否为长任务
+_SCHED_AGING_FACTOR = float(os.environ.get("SCHED_AGING_FACTOR", 1.0))
+_LONG_JOB_SECONDS = float(os.environ.get("LONG_JOB_SECONDS", 120))  # 估算耗时超过该值视为长任务
+_LONG_JOB_SLOTS = max(1, _MAX_CONCURRENT_TASKS - 1)
+_PREFLIGHT_SLOTS = threading.BoundedSemaphore(int(os.environ.get("PREFLIGHT_CONCURRENCY", 4)))
+# 预检元数据中的格式地址带有效期，排队超过该秒数后正式下载时重新解析
+_PREFLIGHT_INFO_MAX_AGE = float(os.environ.get("PREFLIGHT_INFO_MAX_AGE", 300))
+# 耗时估算参数：固定开销 + 下载字节数 / 下载速度 + 音频时长 × 编码耗时比例
+_EST_OVERHEAD_SECONDS = 3.0
+_EST_DOWNLOAD_BYTES_PER_SECOND = float(os.environ.get("EST_DOWNLOAD_MBPS", 4)) * 1024 * 1024
+_EST_ENCODE_RATIO = float(os.environ.get("EST_ENCODE_RATIO", 0.02))  # 编码 1 秒音频约需 0.02 秒
+_EST_AUDIO_BYTES_PER_SECOND = 16000  # 缺少文件大小或时长时按 128 kbps 互相推算
+_EST_DEFAULT_COST = 60.0  # 预检失败时的估算耗时
+_COST_SAMPLES = deque(maxlen=200)  # (估算耗时, 实际耗时)，用于检查估算是否准确
+
+# 时长超过 SEGMENTED_TRANSCODE_MIN_SECONDS 的音频在静音处切段，按 TRANSCODE_WORKERS 个进程并行编码，
+# 见 encoding.transcode_segmented。所有任务的分段编码进程合计不超过 CPU 数
+_TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", os.cpu_count() or 1))
+_SEGMENTED_MIN_SECONDS = float(os.environ.get("SEGMENTED_TRANSCODE_MIN_SECONDS", 1200))
+
+# 优雅退出：收到 SIGTERM 后不再接收新任务，宽限期内能完成的任务继续，其余任务保存断点。
+# 任务工作目录固定为 WORK_DIR/<task_id>，断点文件与 .part 文件放在一起，
+# 重启后的进程（或挂载同一目录的其他实例）从已下载的字节处继续
+_WORK_DIR = os.environ.get("WORK_DIR") or os.path.join(tempfile.gettempdir(), "listentube_work")
+_CHECKPOINT_FILE = "checkpoint.json"
+_PARTIAL_SUFFIXES = (".part", ".ytdl")  # yt-dlp 断点续传需要的文件
+# 超过该秒数仍无人认领的断点视为废弃并删除
+_CHECKPOINT_TTL_SECONDS = int(os.environ.get("CHECKPOINT_TTL_SECONDS", 21600))
+_DRAIN_GRACE_SECONDS = float(os.environ.get("DRAIN_GRACE_SECONDS", 8))  # Cloud Run 在 SIGTERM 后 10 秒强制结束
+_DRAINING = threading.Event()
+# 所有轮询过任务的客户端超过该时间没有再查询时自动取消任务，0 表示关闭。
+# 浏览器后台标签页的定时器可能被节流到每分钟一次，因此不能设置得太短
+_WATCH_TIMEOUT_SECONDS = int(os.environ.get("WATCH_TIMEOUT_SECONDS", 120))
+_WATCHDOG_INTERVAL_SECONDS = 5
+
+# 完成回调：POST /tasks 提供 callback_url 时，任务结束后发送签名的 POST，见 webhooks.py。
+# 未设置 WEBHOOK_SECRET 时不接受回调地址
+_WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+# 逗号分隔的可信主机名；设置后只接受这些主机，未设置时只接受解析到公网地址的主机
+_WEBHOOK_ALLOWED_HOSTS = frozenset(
+    h.strip().lower() for h in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()
+)
+_WEBHOOKS = WebhookDispatcher(
+    _WEBHOOK_SECRET,
+    workers=int(os.environ.get("WEBHOOK_WORKERS", 2)),
+    allowed_hosts=_WEBHOOK_ALLOWED_HOSTS,
+) if _WEBHOOK_SECRET else None
+# 回调中的 artifact_url 使用该地址作为前缀，未设置时使用创建任务请求的地址
+_PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL")
+# 不返回给客户端的内部字段
+_PRIVATE_TASK_FIELDS = ("file_path", "temp_dir", "watched_at", "base_url")
+
+# 内容寻址的产物存储：同一份音频只保存一次，URL 由内容哈希决定，可被 CDN 与
+# Service Worker 永久缓存。文件通过存储后端保存，见 storage.py
+_ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR") or os.path.join(tempfile.gettempdir(), "listentube_artifacts")
+_ARTIFACT_TTL_SECONDS = int(os.environ.get("ARTIFACT_TTL_SECONDS", 86400))  # 最后一次访问后保留 1 天
+_ARTIFACT_MAX_AGE_SECONDS = 31536000  # 1 年
+_ARTIFACTS = {}  # digest -> {"ext", "size", "last_access"}，本实例写入或访问过的产物
+_ARTIFACT_NAME_RE = re.compile(r"^([0-9a-f]{64})\.(mp3|m4a|opus)$")
+_STORAGE = create_storage(_ARTIFACT_DIR)
+
+# cookies 身份池：每个任务尝试分配一个身份，被限流的身份暂停使用，见 credentials.py
+_COOKIES_DIR = os.environ.get("COOKIES_DIR") or CREDENTIAL_CONFIG["cookie_dir"]
+_CREDENTIALS = CredentialPool(
+    cooldown=CREDENTIAL_CONFIG["cooldown_seconds"],
+    max_cooldown=CREDENTIAL_CONFIG["max_cooldown_seconds"],
+)
+
 
 def _now_ts() -> float:
     return time.time()
 
 
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _artifact_key(digest: str, audio_ext: str) -> str:
+    return f"{digest}.{audio_ext}"
+
+
+def _task_manifest_key(task_id: str) -> str:
+    return f"tasks/{task_id}.json"
+
+
+def _store_artifact(src_path: str, audio_ext: str) -> str:
+    """把转换好的文件写入存储后端，返回内容哈希"""
+    digest = _hash_file(src_path)
+    key = _artifact_key(digest, audio_ext)
+    size = _STORAGE.size(key)
+    if size is None:
+        size = os.path.getsize(src_path)
+        _STORAGE.put(key, src_path)
+    # 已有相同内容时直接复用。上传到远程存储或复用已有产物时本地文件仍在，立即删除：
+    # Cloud Run 的本地磁盘占用的是实例内存
+    try:
+        os.remove(src_path)
+    except OSError:
+        pass
+    with _TASKS_LOCK:
+        _ARTIFACTS[digest] = {
+            "ext": audio_ext,
+            "size": size,
+            "last_access": _now_ts(),
+        }
+    return digest
+
+
+def _write_task_manifest(task_id: str, digest: str, audio_ext: str, title: str):
+    """记录任务对应的产物，让其他实例也能响应该任务的 /play 与 /download"""
+    manifest = {"artifact": digest, "format": audio_ext, "title": title}
+    try:
+        _STORAGE.put_bytes(_task_manifest_key(task_id), json.dumps(manifest).encode("utf-8"))
+    except Exception:
+        pass
+
+
+def _load_task_manifest(task_id: str):
+    try:
+        data = _STORAGE.get_bytes(_task_manifest_key(task_id))
+        return json.loads(data) if data else None
+    except Exception:
+        return None
+
+
+def _load_artifacts():
+    """启动时重新登记本地产物目录中已有的文件"""
+    if not isinstance(_STORAGE, LocalStorage):
+        return
+    try:
+        names = os.listdir(_STORAGE.root)
+    except OSError:
+        return
+    now = _now_ts()
+    with _TASKS_LOCK:
+        for name in names:
+            match = _ARTIFACT_NAME_RE.match(name)
+            if not match:
+                continue
+            _ARTIFACTS[match.group(1)] = {
+                "ext": match.group(2),
+                "size": os.path.getsize(os.path.join(_STORAGE.root, name)),
+                "last_access": now,
+            }
+
+
+def _load_credentials():
+    errors = _CREDENTIALS.load(cookie_paths(CREDENTIAL_CONFIG["cookie_files"], _COOKIES_DIR))
+    for error in errors:
+        print(f"⚠️ 无法加载 cookies 文件 {error}")
+
+
+def _artifact_url(digest: str, audio_ext: str) -> str:
+    return f"/artifacts/{digest}.{audio_ext}"
+
+
+def _touch_artifact(digest: str):
+    with _TASKS_LOCK:
+        artifact = _ARTIFACTS.get(digest)
+        if artifact:
+            artifact["last_access"] = _now_ts()
+
+
+def _evict_artifacts(now: float):
+    """清理长时间未访问且没有任务引用的产物"""
+    with _TASKS_LOCK:
+        referenced = {t.get("artifact") for t in _TASKS.values() if t.get("artifact")}
+        stale = [
+            digest for digest, a in _ARTIFACTS.items()
+            if digest not in referenced and now > a["last_access"] + _ARTIFACT_TTL_SECONDS
+        ]
+        removed = [(digest, _ARTIFACTS.pop(digest)) for digest in stale]
+    if _STORAGE.manages_expiry:
+        # 对象存储由生命周期规则负责过期，其他实例可能仍在使用这些产物
+        return
+    for digest, artifact in removed:
+        try:
+            _STORAGE.delete(_artifact_key(digest, artifact["ext"]))
+        except Exception:
+            pass
+
+
+def _send_artifact(digest: str, audio_ext: str, download_name: str = None,
+                   as_attachment: bool = False, immutable: bool = False):
+    """从存储后端发送产物，支持条件请求和 Range 分段请求"""
+    key = _artifact_key(digest, audio_ext)
+    mime_type, _ = get_audio_mime_and_ext(audio_ext)
+    max_age = _ARTIFACT_MAX_AGE_SECONDS if immutable else 0
+
+    local_path = _STORAGE.local_path(key)
+    if local_path is not None:
+        response = send_file(
+            local_path,
+            mimetype=mime_type,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=digest,
+            max_age=max_age,
+        )
+    else:
+        size = _STORAGE.size(key)
+        if size is None:
+            return jsonify({"error": "file not found"}), 404
+        response = _send_remote_artifact(key, size, digest, mime_type, download_name, as_attachment)
+        if not immutable:
+            response.cache_control.no_cache = True
+
+    if immutable:
+        response.headers["Cache-Control"] = f"public, max-age={_ARTIFACT_MAX_AGE_SECONDS}, immutable"
+    _touch_artifact(digest)
+    return response
+
+
+def _send_remote_artifact(key: str, size: int, digest: str, mime_type: str,
+                          download_name: str, as_attachment: bool):
+    """把客户端的 Range 请求转发给存储后端，按块流式返回，不在内存中缓存整个文件"""
+    if request.if_none_match.contains(digest):
+        response = Response(status=304)
+        response.set_etag(digest)
+        return response
+
+    byte_range = request.range
+    if byte_range is not None and request.if_range.etag and request.if_range.etag != digest:
+        # If-Range 不匹配时返回完整内容
+        byte_range = None
+    span = byte_range.range_for_length(size) if byte_range is not None else None
+    if byte_range is not None and span is None:
+        response = Response(status=416)
+        response.headers["Content-Range"] = f"bytes */{size}"
+        return response
+
+    start, stop = span or (0, size)
+    response = Response(
+        _STORAGE.read_range(key, start, stop),
+        status=206 if span else 200,
+        mimetype=mime_type,
+        direct_passthrough=True,
+    )
+    response.content_length = stop - start
+    response.accept_ranges = "bytes"
+    if span:
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    response.set_etag(digest)
+    if download_name:
+        disposition = "attachment" if as_attachment else "inline"
+        try:
+            download_name.encode("ascii")
+            response.headers.set("Content-Disposition", disposition, filename=download_name)
+        except UnicodeEncodeError:
+            response.headers.set(
+                "Content-Disposition",
+                disposition,
+                **{"filename*": f"UTF-8''{quote(download_name)}"},
+            )
+    return response
+
+
 def _cleanup_task(task_id: str):
     task = _TASKS.get(task_id)
     if not task:
         return
-    file_path = task.get("file_path")
     temp_dir = task.get("temp_dir")
-    try:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-    except Exception:
-        pass
+    # 产物文件由内容寻址存储统一管理，这里只删除任务清单
+    if task.get("artifact"):
+        try:
+            _STORAGE.delete(_task_manifest_key(task_id))
+        except Exception:
+            pass
     try:
         if temp_dir and os.path.isdir(temp_dir):
             # try to remove temp dir when empty
@@ -162,6 +440,9 @@ def _janitor_loop():
             _cleanup_task(tid)
             with _TASKS_LOCK:
                 _TASKS.pop(tid, None)
+        _evict_artifacts(now)
+        _save_popularity()
+        _restore_checkpoints()
 
 
 def _clean_ansi(text):
@@ -172,7 +453,12 @@ def _clean_ansi(text):
     return text
 
 def _progress_hook(task_id: str):
+    cancel_event = _CANCEL_EVENTS.get(task_id)
+
     def _hook(d):
+        # 协作式取消：下载过程中每次回调都检查一次
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelled("task cancelled")
         with _TASKS_LOCK:
             task = _TASKS.get(task_id)
             if not task:
@@ -219,104 +505,1025 @@ def _progress_hook(task_id: str):
                 task["progress"] = 100.0
                 task["speed"] = "完成"
                 task["eta"] = 0
+            elif d.get("status") == "encoding":
+                task["progress"] = 100.0
+                task["eta"] = None
+                if d.get("encode_percent") is not None:
+                    # 分段并行转码时汇总各段进度
+                    task["encode_progress"] = round(d["encode_percent"], 1)
+                    task["speed"] = f"转码中 {d['encode_percent']:.0f}%"
+                else:
+                    task["speed"] = "转码中"
     return _hook
 
 
-def _run_download_task(task_id: str, video_url: str, audio_ext: str):
-    temp_dir = tempfile.mkdtemp(prefix=f"yt_task_{task_id}_")
-    base_name = f"{uuid.uuid4()}"
-    output_template = os.path.join(temp_dir, base_name + ".%(ext)s")
-
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        "format": "bestaudio/best",
+def _build_ydl_opts(output_template: str, progress_hooks) -> dict:
+    # 只负责下载原始音频流，编码由 encoding.py 按预设完成
+    ydl_opts = copy.deepcopy(YT_DLP_CONFIG)
+    ydl_opts.update({
         "outtmpl": output_template,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": audio_ext,
-                "preferredquality": "192",
-            }
-        ],
-        "progress_hooks": [_progress_hook(task_id)],
-        # 添加 cookies 支持
-        "cookiefile": "cookies.txt",  # 如果存在 cookies.txt 文件
-        # 设置用户代理
-        "http_headers": {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+        "progress_hooks": progress_hooks,
+        # 单次请求失败后才退避，正常下载不等待
+        "retry_sleep_functions": {
+            "http": _network_retry_sleep,
+            "fragment": _network_retry_sleep,
         },
-        # 添加更多选项来绕过验证
-        "extractor_retries": 3,
-        "fragment_retries": 3,
-        "retries": 3,
-        "file_access_retries": 3,
-        "sleep_interval": 1,
-        "max_sleep_interval": 5,
-        # 额外的绕过选项
-        "no_check_certificate": True,
-        "prefer_insecure": True,
-        "add_header": [
-            "Accept-Language: en-US,en;q=0.9",
-            "Accept-Encoding: gzip, deflate, br",
-            "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "DNT: 1",
-            "Connection: keep-alive",
-            "Upgrade-Insecure-Requests: 1",
-        ],
-        # 使用不同的提取器
-        "extractor_args": {
-            "youtube": {
-                "player_client": ["android", "web"],
-                "player_skip": ["webpage", "configs"],
-            }
+    })
+    return ydl_opts
+
+
+def _network_retry_sleep(n: int) -> float:
+    """yt-dlp 以 sleep_func(n=重试序号) 调用，n 从 0 开始"""
+    return backoff_delay(RETRY_POLICIES[NETWORK], n + 1)
+
+
+def _parse_timestamp(value) -> Optional[float]:
+    """解析秒数或 HH:MM:SS / MM:SS 格式的时间点"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        parts = str(value).strip().split(":")
+        if len(parts) > 3:
+            raise ValueError(f"invalid timestamp: {value}")
+        seconds = 0.0
+        for part in parts:
+            try:
+                seconds = seconds * 60 + float(part)
+            except ValueError:
+                raise ValueError(f"invalid timestamp: {value}") from None
+    if not seconds >= 0 or seconds == float("inf"):
+        raise ValueError(f"invalid timestamp: {value}")
+    return seconds
+
+
+def _format_clip(clip) -> str:
+    start, end = clip
+    return f"{start:g}-{end:g}" if end is not None else f"{start:g}-"
+
+
+def _clip_beyond_message(start: float, duration: float) -> str:
+    # retry.classify_error 按这句话把错误归为 fatal
+    return f"clip start {start:g}s is beyond the video duration {duration:g}s"
+
+
+def _download_clip(ydl, info: dict, clip, temp_dir: str, progress_path: str, clip_state: dict,
+                   group: Optional[ProcessGroup] = None) -> str:
+    """用 ffmpeg 只下载片段对应的音频（不重新编码），返回文件路径
+
+    参数与 yt-dlp 的 ffmpeg 下载器（download_ranges）一致：-ss/-t 作用于输入，对 HTTP 源
+    通过 Range 请求只拉取片段对应的字节；由本进程启动 ffmpeg，取消时可以通过 group 直接终止
+    """
+    start, end = clip
+    duration = info.get("duration")
+    clip_end = end if end is not None else float("inf")
+    if duration:
+        if start >= duration:
+            raise ValueError(_clip_beyond_message(start, duration))
+        clip_end = min(clip_end, duration)
+    clip_state["duration"] = clip_end - start if clip_end != float("inf") else None
+
+    formats = info.get("requested_formats") or [info]
+    fmt = next((f for f in formats if f.get("acodec") not in (None, "none")), formats[0])
+    url = fmt.get("url")
+    if not url:
+        raise RuntimeError("no downloadable audio url for clip")
+    input_args = []
+    if re.match(r"^https?://", url):
+        cookies = ydl.cookiejar.get_cookies_for_url(url)
+        if cookies:
+            input_args += ["-cookies", "".join(
+                f"{c.name}={c.value}; path={c.path}; domain={c.domain};\r\n" for c in cookies)]
+        if fmt.get("http_headers"):
+            input_args += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in fmt["http_headers"].items())]
+    input_args += ["-ss", f"{start:g}"]
+    if clip_state["duration"] is not None:
+        input_args += ["-t", f"{clip_state['duration']:g}"]
+    # Matroska 可以容纳任意音频编码，-c copy 不需要按源格式选择容器
+    source_path = os.path.join(temp_dir, "audio.clip.mka")
+    run_ffmpeg([
+        *input_args, "-i", url,
+        "-map", "0:a:0", "-c", "copy",
+        "-progress", progress_path, "-nostats",
+        source_path,
+    ], group)
+    return source_path
+
+
+def _watch_clip_progress(progress_path: str, clip_state: dict, progress_hooks, stop_event: threading.Event):
+    """片段下载由 ffmpeg 完成，yt-dlp 不回调中间进度；读取 ffmpeg -progress 输出，
+    按片段时长换算成与普通下载相同格式的进度回调"""
+    started = _now_ts()
+    while not stop_event.wait(1.0):
+        try:
+            with open(progress_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(f.tell() - 4096, 0))
+                lines = f.read().decode("utf-8", "replace").splitlines()
+        except OSError:
+            continue
+        values = {}
+        for line in lines:
+            key, sep, value = line.partition("=")
+            if sep:
+                values[key.strip()] = value.strip()
+        try:
+            out_seconds = int(values.get("out_time_us", 0)) / 1e6
+            downloaded = int(values.get("total_size", 0))
+        except ValueError:
+            continue
+        duration = clip_state.get("duration")
+        if not duration or out_seconds <= 0:
+            continue
+        fraction = min(out_seconds / duration, 1.0)
+        elapsed = max(_now_ts() - started, 1e-6)
+        d = {
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": int(downloaded / fraction),
+            "_percent_str": f"{fraction * 100:.1f}%",
+            "_speed_str": f"{downloaded / elapsed / 1024 / 1024:.2f}MiB/s",
+            "eta": int(elapsed / fraction - elapsed),
         }
-    }
+        for hook in progress_hooks:
+            try:
+                hook(d)
+            except Exception:
+                pass
+
+
+def _download_audio(video_url: str, audio_ext: str, temp_dir: str, progress_hooks, clip=None,
+                    profile: Optional[str] = None, identity=None, info: Optional[dict] = None,
+                    group: Optional[ProcessGroup] = None) -> Tuple[str, str]:
+    """下载并转换音频，返回 (文件路径, 标题)
+
+    clip 为 (start, end) 秒数时只下载并编码该时间段，end 为 None 表示到结尾；
+    profile 为 config.ENCODER_PROFILES 中的编码预设；identity 为身份池分配的 cookies；
+    info 为预检得到的元数据，提供时直接下载，不再重复解析页面；
+    group 收集本次启动的 ffmpeg 进程，调用方可以随时终止
+    """
+    # 固定文件名：断点续传时 yt-dlp 按文件名找到 .part 文件继续下载
+    base_name = "audio"
+    output_template = os.path.join(temp_dir, base_name + ".%(ext)s")
+    ydl_opts = _build_ydl_opts(output_template, progress_hooks)
+
+    watcher = None
+    source_path = None
+    if clip:
+        # 片段由 _download_clip 调用 ffmpeg 下载，yt-dlp 只负责解析；后续编码也只处理片段
+        clip_state = {}
+        progress_path = os.path.join(temp_dir, "ffmpeg.progress")
+        stop_event = threading.Event()
+        watcher = threading.Thread(
+            target=_watch_clip_progress,
+            args=(progress_path, clip_state, progress_hooks, stop_event),
+            daemon=True,
+        )
+        watcher.start()
 
     try:
         with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
+            if identity is not None:
+                identity.apply(ydl.cookiejar)
+            download = not clip
+            if info is not None:
+                info = ydl.process_ie_result(copy.deepcopy(info), download=download)
+            else:
+                info = ydl.extract_info(video_url, download=download)
             title = info.get("title") or "audio"
-        audio_path = os.path.join(temp_dir, base_name + f".{audio_ext}")
-        if not os.path.exists(audio_path):
-            # Fallback
-            produced = [
-                os.path.join(temp_dir, f)
-                for f in os.listdir(temp_dir)
-                if f.startswith(base_name + ".")
+            if clip:
+                source_path = _download_clip(ydl, info, clip, temp_dir, progress_path, clip_state, group)
+    finally:
+        if watcher is not None:
+            stop_event.set()
+            watcher.join()
+
+    if source_path is None:
+        downloads = info.get("requested_downloads") or []
+        source_path = downloads[0].get("filepath") if downloads else None
+    if not source_path or not os.path.exists(source_path):
+        # Fallback
+        produced = [
+            os.path.join(temp_dir, f)
+            for f in os.listdir(temp_dir)
+            if f.startswith(base_name + ".") and not f.endswith(".part")
+        ]
+        source_path = produced[0] if produced else None
+    if not source_path or not os.path.exists(source_path):
+        raise RuntimeError("audio file not found after download")
+
+    for hook in progress_hooks:
+        hook({"status": "encoding"})
+    audio_path = os.path.join(temp_dir, f"{base_name}.out.{audio_ext}")
+    duration = clip_state.get("duration") if clip else info.get("duration")
+    if _use_segmented_transcode(duration, audio_ext, profile, info.get("acodec")):
+        def _encode_progress(percent):
+            for hook in progress_hooks:
+                hook({"status": "encoding", "encode_percent": percent})
+
+        transcode_segmented(source_path, audio_path, audio_ext, profile,
+                            workers=_TRANSCODE_WORKERS, progress=_encode_progress, group=group)
+    else:
+        transcode(source_path, audio_path, audio_ext, profile, src_codec=info.get("acodec"), group=group)
+    os.remove(source_path)
+    return audio_path, title
+
+
+def _use_segmented_transcode(duration: Optional[float], audio_ext: str, profile: Optional[str],
+                             src_codec: Optional[str]) -> bool:
+    """长音频且需要重新编码时分段并行转码"""
+    if _TRANSCODE_WORKERS < 2 or not duration or duration < _SEGMENTED_MIN_SECONDS:
+        return False
+    return not can_copy(audio_ext, profile, src_codec)
+
+
+def _remove_dir(temp_dir: str):
+    try:
+        for name in os.listdir(temp_dir):
+            try:
+                os.remove(os.path.join(temp_dir, name))
+            except Exception:
+                pass
+        os.rmdir(temp_dir)
+    except Exception:
+        pass
+
+
+def _kill_task_processes(task_id: str):
+    """终止任务启动的 ffmpeg 进程（片段下载和转码），之后再启动的进程也会立即终止"""
+    with _TASKS_LOCK:
+        group = _TASK_PROCESSES.get(task_id)
+    if group is not None:
+        group.kill()
+
+
+def _queue_webhook(task: dict):
+    """任务进入最终状态时调用（持有 _TASKS_LOCK），把结果放入回调队列"""
+    callback_url = task.get("callback_url")
+    if not callback_url or _WEBHOOKS is None:
+        return
+    artifact_url = task.get("artifact_url")
+    if artifact_url:
+        artifact_url = task.get("base_url", "") + artifact_url
+    _WEBHOOKS.enqueue(callback_url, {
+        "event": f"task.{task['status']}",
+        "id": task["id"],
+        "status": task["status"],
+        "url": task.get("url"),
+        "format": task.get("format"),
+        "title": task.get("title"),
+        "size": task.get("size"),
+        "artifact_url": artifact_url,
+        "error": task.get("error"),
+        "error_class": task.get("error_class"),
+        "completed_at": _now_ts(),
+    })
+
+
+def _cancel_task(task_id: str, reason: str) -> bool:
+    """取消排队中或下载中的任务，立即终止子进程并删除已下载的部分文件"""
+    with _TASKS_LOCK:
+        task = _TASKS.get(task_id)
+        if not task or task.get("status") not in ("queued", "downloading"):
+            return False
+        task.update({
+            "status": "cancelled",
+            "error": reason,
+            "speed": "已取消",
+            "eta": None,
+            "expires_at": _now_ts() + _TASK_TTL_SECONDS,
+        })
+        _queue_webhook(task)
+        # 唤醒排队等待槽位的线程
+        _SCHED_COND.notify_all()
+        cancel_event = _CANCEL_EVENTS.get(task_id)
+        temp_dir = task.get("temp_dir")
+    if cancel_event is not None:
+        cancel_event.set()
+    _kill_task_processes(task_id)
+    if temp_dir:
+        _remove_dir(temp_dir)
+    return True
+
+
+def _watchdog_loop():
+    """所有观察任务的客户端都断开后自动取消任务"""
+    while True:
+        time.sleep(_WATCHDOG_INTERVAL_SECONDS)
+        now = _now_ts()
+        with _TASKS_LOCK:
+            abandoned = [
+                tid for tid, t in _TASKS.items()
+                if t.get("status") in ("queued", "downloading")
+                # 使用回调的调用方不会轮询，不能据此判断客户端已断开
+                and not t.get("callback_url")
+                and t.get("watched_at")
+                and now - t["watched_at"] > _WATCH_TIMEOUT_SECONDS
             ]
-            audio_path = produced[0] if produced else None
-        if not audio_path or not os.path.exists(audio_path):
-            raise RuntimeError("audio file not found after processing")
+        for tid in abandoned:
+            _cancel_task(tid, "all watching clients disconnected")
+
+
+def _download_with_retries(task_id: str, video_url: str, audio_ext: str, temp_dir: str,
+                           cancel_event: threading.Event, clip=None, profile=None, info=None,
+                           info_identity=None, group: Optional[ProcessGroup] = None) -> Tuple[str, str]:
+    """按失败类型重试下载，只在失败后退避；上游熔断时直接失败
+
+    info 为预检得到的元数据，只用于第一次尝试，重试时重新解析以获取新的下载地址；
+    info_identity 为预检使用的身份，第一次尝试沿用它，该身份已进入冷却时改为重新解析；
+    group 为任务的 ffmpeg 进程组，取消时被终止
+    """
+    breaker = get_breaker(extractor_key(video_url))
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(f"upstream {extractor_key(video_url)} is rejecting requests, try again later")
+        attempt += 1
+        attempt_info = None
+        if attempt == 1 and info is not None:
+            identity = _CREDENTIALS.acquire(prefer=info_identity)
+            # 下载地址和 cookies 必须来自同一个会话，换了身份就重新解析
+            if identity is info_identity:
+                attempt_info = info
+        else:
+            identity = _CREDENTIALS.acquire()
+        try:
+            result = _download_audio(video_url, audio_ext, temp_dir, [_progress_hook(task_id)],
+                                     clip=clip, profile=profile, identity=identity,
+                                     info=attempt_info, group=group)
+        except DownloadCancelled:
+            _CREDENTIALS.release(identity, cancelled=True)
+            raise
+        except Exception as exc:
+            if cancel_event.is_set():
+                # 取消或保存断点时终止了 ffmpeg，失败与上游和身份无关
+                _CREDENTIALS.release(identity, cancelled=True)
+                raise DownloadCancelled("task cancelled") from exc
+            error_class = classify_error(exc)
+            breaker.record_failure(error_class)
+            _CREDENTIALS.release(identity, error_class)
+            policy = RETRY_POLICIES[error_class]
+            if attempt >= policy.max_attempts or cancel_event.is_set():
+                with _TASKS_LOCK:
+                    task = _TASKS.get(task_id)
+                    if task is not None:
+                        task["error_class"] = error_class
+                raise
+            delay = backoff_delay(policy, attempt)
+            if identity is not None and error_class in BLOCKING_ERRORS and _CREDENTIALS.available() > 0:
+                # 被拒绝的是这个身份，换一个可用身份立即重试
+                delay = 0
+            with _TASKS_LOCK:
+                task = _TASKS.get(task_id)
+                if task is not None:
+                    task["retries"] = task.get("retries", 0) + 1
+                    task["error_class"] = error_class
+                    task["speed"] = f"重试中 ({error_class})"
+                    task["eta"] = None
+            # 上一次尝试的残留文件不再需要；网络中断和限流时保留 .part，重试从已下载的字节处继续
+            keep_partial = error_class in (NETWORK, THROTTLED)
+            for name in os.listdir(temp_dir):
+                if keep_partial and name.endswith(_PARTIAL_SUFFIXES):
+                    continue
+                try:
+                    os.remove(os.path.join(temp_dir, name))
+                except OSError:
+                    pass
+            if cancel_event.wait(delay):
+                raise DownloadCancelled("task cancelled")
+            continue
+        breaker.record_success()
+        _CREDENTIALS.release(identity)
+        return result
+
+
+def _estimate_cost(duration: Optional[float], size: Optional[float]) -> float:
+    """估算任务耗时（秒）"""
+    if not duration and not size:
+        return _EST_DEFAULT_COST
+    if not size:
+        size = duration * _EST_AUDIO_BYTES_PER_SECOND
+    if not duration:
+        duration = size / _EST_AUDIO_BYTES_PER_SECOND
+    encode_seconds = duration * _EST_ENCODE_RATIO
+    if _TRANSCODE_WORKERS > 1 and duration >= _SEGMENTED_MIN_SECONDS:
+        # 长音频分段并行转码
+        encode_seconds /= _TRANSCODE_WORKERS
+    return _EST_OVERHEAD_SECONDS + size / _EST_DOWNLOAD_BYTES_PER_SECOND + encode_seconds
+
+
+def _preflight(video_url: str, clip=None):
+    """只解析元数据，返回 (info, 时长, 下载字节数, 身份)；片段模式按片段占比折算
+
+    身份已经归还，返回它是为了第一次下载沿用同一个身份
+    """
+    ydl_opts = copy.deepcopy(YT_DLP_CONFIG)
+    identity = _CREDENTIALS.acquire()
+    try:
+        with YoutubeDL(ydl_opts) as ydl:
+            if identity is not None:
+                identity.apply(ydl.cookiejar)
+            info = ydl.sanitize_info(ydl.extract_info(video_url, download=False))
+    except Exception as exc:
+        _CREDENTIALS.release(identity, classify_error(exc))
+        raise
+    _CREDENTIALS.release(identity)
+    duration = info.get("duration")
+    size = info.get("filesize") or info.get("filesize_approx")
+    if clip and duration:
+        start, end = clip
+        clip_duration = max(0.0, min(end if end is not None else duration, duration) - start)
+        if size:
+            size = size * clip_duration / duration
+        duration = clip_duration
+    return info, duration, size, identity
+
+
+def _clip_covers_all(clip, duration: Optional[float]) -> bool:
+    """片段是否覆盖整个视频；duration 未知时只有 (0, None) 算覆盖"""
+    start, end = clip
+    if start > 0:
+        return False
+    return end is None or (duration is not None and end >= duration)
+
+
+def _preflight_task(task_id: str, video_url: str, cancel_event: threading.Event, clip=None):
+    """预检并写入估算耗时，返回 (元数据, 估算耗时, 预检使用的身份)；视频本身不可用时直接抛出异常"""
+    while not _PREFLIGHT_SLOTS.acquire(timeout=1):
+        if cancel_event.is_set():
+            return None, _EST_DEFAULT_COST, None
+    info = duration = size = identity = None
+    try:
+        # 上游正在封禁时不额外发请求，按默认耗时排队
+        if get_breaker(extractor_key(video_url)).snapshot()["state"] == "closed":
+            info, duration, size, identity = _preflight(video_url, clip)
+    except Exception as exc:
+        # 只有明确识别出的视频不可用等错误直接失败（classify_error 对无法识别的错误返回 UNKNOWN），
+        # 其他失败交给正式下载的重试逻辑处理，这里只是失去估算依据
+        if classify_error(exc) == FATAL:
+            raise
+    finally:
+        _PREFLIGHT_SLOTS.release()
+    cost = _estimate_cost(duration, size)
+    with _TASKS_LOCK:
+        task = _TASKS.get(task_id)
+        if task is not None:
+            task.update({
+                "duration": duration,
+                "expected_bytes": int(size) if size else None,
+                "expected_cost": round(cost, 1),
+                "speed": "等待中",
+            })
+    return info, cost, identity
+
+
+def _reusable_info(info: Optional[dict], fetched_at: float) -> Optional[dict]:
+    """预检元数据过旧时返回 None：过期的格式地址会返回 403，由正式下载重新解析"""
+    if info is None or _now_ts() - fetched_at > _PREFLIGHT_INFO_MAX_AGE:
+        return None
+    return info
+
+
+def _sched_pick(now: float) -> Optional[str]:
+    """选出下一个获得槽位的任务（持有 _SCHED_COND）"""
+    running_long = sum(1 for is_long in _SCHED_RUNNING.values() if is_long)
+    best, best_key = None, None
+    for task_id, entry in _SCHED_QUEUE.items():
+        if entry["long"] and running_long >= _LONG_JOB_SLOTS:
+            continue
+        key = entry["cost"] - _SCHED_AGING_FACTOR * (now - entry["enqueued_at"])
+        if best_key is None or key < best_key:
+            best, best_key = task_id, key
+    return best
+
+
+def _acquire_slot(task_id: str, cost: float, cancel_event: threading.Event) -> bool:
+    """按调度顺序等待槽位，排队期间被取消返回 False"""
+    with _SCHED_COND:
+        _SCHED_QUEUE[task_id] = {"cost": cost, "long": cost > _LONG_JOB_SECONDS, "enqueued_at": _now_ts()}
+        try:
+            while not cancel_event.is_set():
+                if len(_SCHED_RUNNING) < _MAX_CONCURRENT_TASKS and _sched_pick(_now_ts()) == task_id:
+                    _SCHED_RUNNING[task_id] = _SCHED_QUEUE[task_id]["long"]
+                    # 可能还有空闲槽位，让下一个任务重新判断
+                    _SCHED_COND.notify_all()
+                    return True
+                # 带超时等待：老化会随时间改变顺序
+                _SCHED_COND.wait(timeout=1)
+            return False
+        finally:
+            _SCHED_QUEUE.pop(task_id, None)
+
+
+def _release_slot(task_id: str):
+    with _SCHED_COND:
+        _SCHED_RUNNING.pop(task_id, None)
+        _SCHED_COND.notify_all()
+
+
+def _run_download_task(task_id: str, video_url: str, audio_ext: str, clip=None, profile=None):
+    cancel_event = _CANCEL_EVENTS[task_id]
+    group = _TASK_PROCESSES.get(task_id)
+    temp_dir = None
+    has_slot = False
+    try:
         with _TASKS_LOCK:
             task = _TASKS.get(task_id)
             if task is not None:
+                task["speed"] = "分析中"
+        info, cost, info_identity = _preflight_task(task_id, video_url, cancel_event, clip=clip)
+        info_fetched_at = _now_ts()
+        if clip and info and info.get("duration") and clip[0] >= info["duration"]:
+            # 不占用下载槽位，也不重试
+            raise ValueError(_clip_beyond_message(clip[0], info["duration"]))
+        if clip and info and _clip_covers_all(clip, info.get("duration")):
+            # end 超出视频时长，实际就是完整视频
+            clip = None
+            with _TASKS_LOCK:
+                task = _TASKS.get(task_id)
+                if task is not None:
+                    task.pop("clip", None)
+        # 等待空闲槽位，排队期间被取消则直接退出
+        if not _acquire_slot(task_id, cost, cancel_event):
+            return
+        has_slot = True
+        started_at = _now_ts()
+
+        with _TASKS_LOCK:
+            task = _TASKS.get(task_id)
+            if task is None or cancel_event.is_set():
+                return
+            temp_dir = _task_work_dir(task_id)
+            # 恢复的任务目录已存在，其中的 .part 文件会被继续下载
+            os.makedirs(temp_dir, exist_ok=True)
+            task.update({"status": "downloading", "temp_dir": temp_dir, "started_at": started_at})
+
+        info = _reusable_info(info, info_fetched_at)
+
+        audio_path, title = _download_with_retries(task_id, video_url, audio_ext, temp_dir, cancel_event,
+                                                   clip=clip, profile=profile, info=info,
+                                                   info_identity=info_identity, group=group)
+        if cancel_event.is_set():
+            raise DownloadCancelled("task cancelled")
+        digest = _store_artifact(audio_path, audio_ext)
+        # 产物已写入存储，工作目录中剩下的都是中间文件
+        _remove_dir(temp_dir)
+        _remember_result(video_url, audio_ext, digest, title, clip=clip, profile=profile)
+        _write_task_manifest(task_id, digest, audio_ext, title)
+        with _TASKS_LOCK:
+            artifact = _ARTIFACTS[digest]
+            task = _TASKS.get(task_id)
+            if task is not None and task.get("status") != "cancelled":
+                if task.get("status") == "checkpointed":
+                    # 保存断点时恰好完成，不再需要恢复
+                    _discard_checkpoint(task_id)
+                actual_cost = _now_ts() - started_at
+                _COST_SAMPLES.append((cost, actual_cost))
                 task.update({
                     "status": "finished",
-                    "file_path": audio_path,
                     "temp_dir": temp_dir,
                     "title": title,
+                    "artifact": digest,
+                    "artifact_url": _artifact_url(digest, audio_ext),
+                    "size": artifact["size"],
+                    "actual_cost": round(actual_cost, 1),
                     "expires_at": _now_ts() + _TASK_TTL_SECONDS,
                 })
+                _queue_webhook(task)
     except Exception as exc:
         with _TASKS_LOCK:
             task = _TASKS.get(task_id)
-            if task is not None:
+            # 已取消或已保存断点的任务保持原状态，不覆盖为 error
+            checkpointed = task is not None and task.get("status") == "checkpointed"
+            if task is not None and task.get("status") not in ("cancelled", "checkpointed"):
                 task.update({
                     "status": "error",
                     "error": str(exc),
                     "expires_at": _now_ts() + _TASK_TTL_SECONDS,
                 })
-        # best-effort cleanup
+                _queue_webhook(task)
+        # best-effort cleanup；保存了断点的任务保留已下载的部分文件
+        if temp_dir and not checkpointed:
+            _remove_dir(temp_dir)
+    finally:
+        if has_slot:
+            _release_slot(task_id)
+        _CANCEL_EVENTS.pop(task_id, None)
+        _TASK_PROCESSES.pop(task_id, None)
+
+
+def _task_work_dir(task_id: str) -> str:
+    return os.path.join(_WORK_DIR, task_id)
+
+
+def _discard_checkpoint(task_id: str):
+    try:
+        os.remove(os.path.join(_task_work_dir(task_id), _CHECKPOINT_FILE))
+    except OSError:
+        pass
+
+
+def _checkpoint_task(task_id: str) -> bool:
+    """停止排队中或下载中的任务并保存断点，保留工作目录中已下载的部分文件"""
+    with _TASKS_LOCK:
+        task = _TASKS.get(task_id)
+        if not task or task.get("status") not in ("queued", "downloading"):
+            return False
+        task.update({"status": "checkpointed", "speed": "已暂停", "eta": None})
+        snapshot = {k: v for k, v in task.items() if k not in ("file_path", "temp_dir", "watched_at")}
+        cancel_event = _CANCEL_EVENTS.get(task_id)
+        temp_dir = task.get("temp_dir")
+        _SCHED_COND.notify_all()
+    if cancel_event is not None:
+        cancel_event.set()
+    # 片段模式下由 ffmpeg 下载，终止进程后由恢复的任务重新开始该片段
+    _kill_task_processes(task_id)
+    work_dir = _task_work_dir(task_id)
+    os.makedirs(work_dir, exist_ok=True)
+    tmp_path = os.path.join(work_dir, _CHECKPOINT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, os.path.join(work_dir, _CHECKPOINT_FILE))
+    return True
+
+
+def _remaining_seconds(task: dict, now: float) -> Optional[float]:
+    """估算下载中的任务还需要多久，无法估算时返回 None"""
+    eta = task.get("eta")
+    if isinstance(eta, (int, float)):
+        return eta + (task.get("duration") or 0) * _EST_ENCODE_RATIO
+    if task.get("expected_cost") and task.get("started_at"):
+        return task["expected_cost"] - (now - task["started_at"])
+    return None
+
+
+def _active_task_ids():
+    with _TASKS_LOCK:
+        return [tid for tid, t in _TASKS.items() if t.get("status") in ("queued", "downloading")]
+
+
+def _drain(grace_seconds: float):
+    """停止接收新任务，等待能在宽限期内完成的任务，其余任务保存断点后退出进程"""
+    deadline = time.time() + grace_seconds
+    _DRAINING.set()
+    now = _now_ts()
+    with _TASKS_LOCK:
+        active = [(tid, dict(t)) for tid, t in _TASKS.items() if t.get("status") in ("queued", "downloading")]
+    for tid, task in active:
+        remaining = _remaining_seconds(task, now) if task.get("status") == "downloading" else None
+        # 还没开始的任务和预计完成不了的任务立即保存断点，把时间留给能完成的任务
+        if remaining is None or remaining > grace_seconds - 1:
+            _checkpoint_task(tid)
+    while time.time() < deadline:
+        webhooks_pending = _WEBHOOKS is not None and _WEBHOOKS.snapshot()["pending"] > 0
+        if not _active_task_ids() and not webhooks_pending:
+            break
+        time.sleep(0.2)
+    for tid in _active_task_ids():
+        _checkpoint_task(tid)
+    _save_popularity()
+    os._exit(0)
+
+
+def _handle_sigterm(signum, frame):
+    if _DRAINING.is_set():
+        return
+    # 信号处理函数中不能阻塞，放到后台线程中完成
+    threading.Thread(target=_drain, args=(_DRAIN_GRACE_SECONDS,), name="drain").start()
+
+
+def _work_dir_mtime(work_dir: str) -> float:
+    """目录及其中文件的最近修改时间；下载中的 .part 文件持续写入，但不会更新目录本身的时间"""
+    latest = os.path.getmtime(work_dir)
+    for name in os.listdir(work_dir):
         try:
-            for name in os.listdir(temp_dir):
-                try:
-                    os.remove(os.path.join(temp_dir, name))
-                except Exception:
-                    pass
-            os.rmdir(temp_dir)
-        except Exception:
+            latest = max(latest, os.path.getmtime(os.path.join(work_dir, name)))
+        except OSError:
             pass
+    return latest
+
+
+def _restore_checkpoints():
+    """认领并恢复 WORK_DIR 中保存了断点的任务，启动时和清理线程每轮各执行一次
+
+    WORK_DIR 为共享卷时，其他实例退出后留下的断点由任意存活的实例接手；
+    超过 CHECKPOINT_TTL_SECONDS 仍无人认领的断点，以及没有断点且长时间未修改的工作目录视为残留并删除
+    """
+    if _DRAINING.is_set():
+        return
+    try:
+        names = os.listdir(_WORK_DIR)
+    except OSError:
+        return
+    now = time.time()
+    for name in names:
+        with _TASKS_LOCK:
+            if name in _TASKS:
+                # 本实例的任务
+                continue
+        work_dir = os.path.join(_WORK_DIR, name)
+        checkpoint_path = os.path.join(work_dir, _CHECKPOINT_FILE)
+        if not os.path.exists(checkpoint_path):
+            try:
+                if now - _work_dir_mtime(work_dir) > _TASK_TTL_SECONDS:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        # 先改名认领，多个实例同时扫描时只有一个会恢复该任务
+        claimed_path = f"{checkpoint_path}.{os.getpid()}"
+        try:
+            checkpointed_at = os.path.getmtime(checkpoint_path)
+            os.rename(checkpoint_path, claimed_path)
+            with open(claimed_path) as f:
+                task = json.load(f)
+            os.remove(claimed_path)
+        except (OSError, ValueError):
+            continue
+        task_id = task.get("id")
+        if task_id != name or not task.get("url") or now - checkpointed_at > _CHECKPOINT_TTL_SECONDS:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            continue
+        task.update({
+            "status": "queued",
+            "speed": "等待恢复",
+            "eta": None,
+            "resumed": task.get("resumed", 0) + 1,
+            "expires_at": _now_ts() + _TASK_TTL_SECONDS,
+        })
+        task.pop("started_at", None)
+        clip = (task["clip"]["start"], task["clip"]["end"]) if task.get("clip") else None
+        with _TASKS_LOCK:
+            _TASKS[task_id] = task
+            _CANCEL_EVENTS[task_id] = threading.Event()
+            _TASK_PROCESSES[task_id] = ProcessGroup()
+        threading.Thread(
+            target=_run_download_task,
+            args=(task_id, task["url"], task.get("format") or "mp3", clip, task.get("profile")),
+            daemon=True,
+        ).start()
+
+
+# -------------------------
+# 热度统计、结果缓存与预热
+# -------------------------
+# 未设置 POPULARITY_FILE 时热度数据保存在产物存储中（Cloud Run 的本地磁盘是实例内存，重启即丢失）
+_POPULARITY_FILE = os.environ.get("POPULARITY_FILE")
+_POPULARITY_KEY = "state/popularity.json"
+_POPULARITY_HALF_LIFE_SECONDS = float(os.environ.get("POPULARITY_HALF_LIFE_SECONDS", 86400))  # 热度半衰期 1 天
+_POPULARITY = {}  # video_key -> {"score", "updated_at", "url"}
+_POPULARITY_DIRTY = False
+_RESULT_CACHE = {}  # "video_key:format" -> {"artifact", "title"}，同时以清单形式写入存储，见 _result_manifest_key
+
+_PREWARM_TOP_N = int(os.environ.get("PREWARM_TOP_N", 10))  # 0 表示关闭预热
+_PREWARM_INTERVAL_SECONDS = 60
+_PREWARM_FORMAT = "mp3"
+_PREWARM_MIN_SCORE = 2.0
+_PREWARM_MAX_LOAD = float(os.environ.get("PREWARM_MAX_LOAD", 0.5))  # 每个 CPU 的 1 分钟平均负载上限
+_PREWARM_DISK_BUDGET_BYTES = int(os.environ.get("PREWARM_DISK_BUDGET_MB", 1024)) * 1024 * 1024
+_PREWARM_MIN_FREE_BYTES = 512 * 1024 * 1024
+_PREWARM_YIELD_POLL_SECONDS = 0.5
+_PREWARM_STATE = {"current": None, "warmed": 0, "yielded": 0, "failed": 0, "last_run": None}
+
+_YOUTUBE_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+
+
+def _canonical_video_key(video_url: str) -> str:
+    """同一个视频的不同链接形式（watch、youtu.be、shorts 等）归一到同一个键"""
+    match = _YOUTUBE_ID_RE.search(video_url or "")
+    if match:
+        return f"youtube:{match.group(1)}"
+    return (video_url or "").strip()
+
+
+def _decayed_score(entry: dict, now: float) -> float:
+    elapsed = max(now - entry["updated_at"], 0.0)
+    return entry["score"] * 0.5 ** (elapsed / _POPULARITY_HALF_LIFE_SECONDS)
+
+
+def _record_request(video_url: str):
+    global _POPULARITY_DIRTY
+    key = _canonical_video_key(video_url)
+    now = _now_ts()
+    with _TASKS_LOCK:
+        entry = _POPULARITY.setdefault(key, {"score": 0.0, "updated_at": now, "url": video_url})
+        entry["score"] = _decayed_score(entry, now) + 1.0
+        entry["updated_at"] = now
+        _POPULARITY_DIRTY = True
+
+
+def _read_popularity() -> dict:
+    """读取已保存的热度数据，格式不对的条目直接跳过"""
+    try:
+        if _POPULARITY_FILE:
+            with open(_POPULARITY_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        else:
+            raw = _STORAGE.get_bytes(_POPULARITY_KEY)
+            data = json.loads(raw) if raw else {}
+    except Exception:
+        return {}
+    entries = {}
+    for key, entry in data.items():
+        try:
+            entries[key] = {
+                "score": float(entry["score"]),
+                "updated_at": float(entry["updated_at"]),
+                "url": entry["url"],
+            }
+        except (KeyError, TypeError, ValueError):
+            continue
+    return entries
+
+
+def _load_popularity():
+    entries = _read_popularity()
+    with _TASKS_LOCK:
+        _POPULARITY.update(entries)
+
+
+def _save_popularity():
+    global _POPULARITY_DIRTY
+    now = _now_ts()
+    with _TASKS_LOCK:
+        if not _POPULARITY_DIRTY:
+            return
+        # 热度已衰减到可以忽略的条目不再保存
+        for key in [k for k, e in _POPULARITY.items() if _decayed_score(e, now) < 0.01]:
+            _POPULARITY.pop(key)
+        snapshot = {k: dict(e) for k, e in _POPULARITY.items()}
+        _POPULARITY_DIRTY = False
+    try:
+        if _POPULARITY_FILE:
+            tmp_path = _POPULARITY_FILE + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, _POPULARITY_FILE)
+            return
+        # 多个实例共用同一份数据：与已保存的数据合并，同一视频取衰减后较高的热度（不重复累加）
+        for key, entry in _read_popularity().items():
+            if _decayed_score(entry, now) < 0.01:
+                continue
+            current = snapshot.get(key)
+            if current is None or _decayed_score(entry, now) > _decayed_score(current, now):
+                snapshot[key] = entry
+        _STORAGE.put_bytes(_POPULARITY_KEY, json.dumps(snapshot).encode("utf-8"))
+    except Exception:
+        with _TASKS_LOCK:
+            _POPULARITY_DIRTY = True
+
+
+def _result_cache_key(video_url: str, audio_ext: str, clip=None, profile=None) -> str:
+    key = f"{_canonical_video_key(video_url)}:{audio_ext}"
+    if profile and profile != DEFAULT_ENCODER_PROFILE:
+        key = f"{key}@{profile}"
+    return f"{key}:{_format_clip(clip)}" if clip else key
+
+
+def _result_manifest_key(cache_key: str) -> str:
+    return f"results/{hashlib.sha256(cache_key.encode('utf-8')).hexdigest()}.json"
+
+
+def _remember_result(video_url: str, audio_ext: str, digest: str, title: str, clip=None, profile=None):
+    key = _result_cache_key(video_url, audio_ext, clip, profile)
+    entry = {"artifact": digest, "title": title}
+    with _TASKS_LOCK:
+        _RESULT_CACHE[key] = entry
+    # 写入存储，重启后或其他实例也能命中
+    try:
+        _STORAGE.put_bytes(_result_manifest_key(key), json.dumps(dict(entry, key=key)).encode("utf-8"))
+    except Exception:
+        pass
+
+
+def _load_result_manifest(key: str) -> Optional[dict]:
+    try:
+        raw = _STORAGE.get_bytes(_result_manifest_key(key))
+        manifest = json.loads(raw) if raw else None
+    except Exception:
+        return None
+    if not manifest or manifest.get("key") != key or not manifest.get("artifact"):
+        return None
+    return {"artifact": manifest["artifact"], "title": manifest.get("title") or "audio"}
+
+
+def _lookup_result(video_url: str, audio_ext: str, clip=None, profile=None):
+    """命中时返回 {"artifact", "title", "size"}，产物已被清理则返回 None"""
+    key = _result_cache_key(video_url, audio_ext, clip, profile)
+    with _TASKS_LOCK:
+        cached = _RESULT_CACHE.get(key)
+        cached = dict(cached) if cached else None
+    if cached is None:
+        cached = _load_result_manifest(key)
+        if cached:
+            with _TASKS_LOCK:
+                _RESULT_CACHE[key] = dict(cached)
+    if cached:
+        size = _STORAGE.size(_artifact_key(cached["artifact"], audio_ext))
+        if size is not None:
+            _touch_artifact(cached["artifact"])
+            return dict(cached, size=size)
+        # 产物已过期，清单也不再有用
+        _STORAGE.delete(_result_manifest_key(key))
+    with _TASKS_LOCK:
+        _RESULT_CACHE.pop(key, None)
+    return None
+
+
+def _has_user_work() -> bool:
+    with _TASKS_LOCK:
+        return any(t.get("status") in ("queued", "downloading") for t in _TASKS.values())
+
+
+def _prewarm_hook(d):
+    # 一旦有用户任务进来立即让出，由 yt-dlp 中止当前下载
+    if _has_user_work():
+        raise DownloadCancelled("prewarm yielded to user task")
+
+
+def _prewarm_budget_ok() -> bool:
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        load = 0.0
+    if load > _PREWARM_MAX_LOAD:
+        return False
+    # 预热的下载和转码写在临时目录；产物只有本地存储时才占用本机磁盘
+    paths = [tempfile.gettempdir()]
+    if isinstance(_STORAGE, LocalStorage):
+        with _TASKS_LOCK:
+            used = sum(a["size"] for a in _ARTIFACTS.values())
+        if used >= _PREWARM_DISK_BUDGET_BYTES:
+            return False
+        paths.append(_STORAGE.root)
+    return all(shutil.disk_usage(path).free > _PREWARM_MIN_FREE_BYTES for path in paths)
+
+
+def _watch_prewarm(group: ProcessGroup, done: threading.Event):
+    # 转码阶段没有进度回调，由这里轮询用户任务并终止预热的 ffmpeg
+    while not done.wait(_PREWARM_YIELD_POLL_SECONDS):
+        if _has_user_work():
+            group.kill()
+            return
+
+
+def _prewarm_candidates():
+    now = _now_ts()
+    with _TASKS_LOCK:
+        ranked = sorted(
+            ((_decayed_score(e, now), key, e["url"]) for key, e in _POPULARITY.items()),
+            reverse=True,
+        )[:_PREWARM_TOP_N]
+    return [
+        (key, url) for score, key, url in ranked
+        if score >= _PREWARM_MIN_SCORE and _lookup_result(url, _PREWARM_FORMAT) is None
+    ]
+
+
+def _prewarm_loop():
+    while True:
+        time.sleep(_PREWARM_INTERVAL_SECONDS)
+        for key, video_url in _prewarm_candidates():
+            if _DRAINING.is_set() or _has_user_work() or not _prewarm_budget_ok():
+                break
+            breaker = get_breaker(extractor_key(video_url))
+            if breaker.snapshot()["state"] != "closed":
+                # 上游正在封禁时不消耗额度去预热
+                continue
+            _PREWARM_STATE["current"] = key
+            temp_dir = tempfile.mkdtemp(prefix="yt_prewarm_")
+            identity = _CREDENTIALS.acquire()
+            group = ProcessGroup()
+            done = threading.Event()
+            threading.Thread(target=_watch_prewarm, args=(group, done), daemon=True).start()
+            try:
+                audio_path, title = _download_audio(video_url, _PREWARM_FORMAT, temp_dir, [_prewarm_hook],
+                                                    identity=identity, group=group)
+                digest = _store_artifact(audio_path, _PREWARM_FORMAT)
+                _remember_result(video_url, _PREWARM_FORMAT, digest, title)
+                breaker.record_success()
+                _CREDENTIALS.release(identity)
+                _PREWARM_STATE["warmed"] += 1
+            except DownloadCancelled:
+                _CREDENTIALS.release(identity, cancelled=True)
+                _PREWARM_STATE["yielded"] += 1
+                break
+            except Exception as exc:
+                if group.killed:
+                    # ffmpeg 被终止导致的失败也是让出
+                    _CREDENTIALS.release(identity, cancelled=True)
+                    _PREWARM_STATE["yielded"] += 1
+                    break
+                error_class = classify_error(exc)
+                breaker.record_failure(error_class)
+                _CREDENTIALS.release(identity, error_class)
+                _PREWARM_STATE["failed"] += 1
+            finally:
+                done.set()
+                _remove_dir(temp_dir)
+                _PREWARM_STATE["current"] = None
+        _PREWARM_STATE["last_run"] = _now_ts()
 
 
 @app.route("/tasks", methods=["POST"])
@@ -326,25 +1533,88 @@ def create_task():
     requested_format = payload.get("format") or request.args.get("format") or "mp3"
     if not video_url:
         return jsonify({"error": "missing 'url'"}), 400
+    if _DRAINING.is_set():
+        return jsonify({"error": "server is shutting down, retry on another instance"}), 503, {"Retry-After": "5"}
+
+    # 片段模式：只下载并转换 start 到 end 之间的内容
+    try:
+        clip_start = _parse_timestamp(payload.get("start", request.args.get("start")))
+        clip_end = _parse_timestamp(payload.get("end", request.args.get("end")))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    clip = None
+    if clip_start is not None or clip_end is not None:
+        clip = (clip_start or 0.0, clip_end)
+        if clip_end is not None and clip_end <= clip[0]:
+            return jsonify({"error": "'end' must be greater than 'start'"}), 400
+        if _clip_covers_all(clip, None):
+            # 从头到尾不算片段：走普通下载（可断点续传），与完整视频共用结果缓存
+            clip = None
 
     _, audio_ext = get_audio_mime_and_ext(requested_format)
+    # 编码预设：default / music / voice，见 config.ENCODER_PROFILES
+    profile = payload.get("profile") or request.args.get("profile") or DEFAULT_ENCODER_PROFILE
+    try:
+        resolve_profile(audio_ext, profile)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    callback_url = payload.get("callback_url") or request.args.get("callback_url")
+    if callback_url:
+        if _WEBHOOKS is None:
+            return jsonify({"error": "callbacks are disabled: WEBHOOK_SECRET is not configured"}), 400
+        if not valid_callback_url(callback_url, _WEBHOOK_ALLOWED_HOSTS):
+            return jsonify({"error": "'callback_url' must be an http(s) URL on a public or allowed host"}), 400
+
+    _record_request(video_url)
     task_id = str(uuid.uuid4())
+    task = {
+        "id": task_id,
+        "status": "queued",
+        "progress": 0.0,
+        "created_at": _now_ts(),
+        "expires_at": _now_ts() + _TASK_TTL_SECONDS,
+        "url": video_url,
+        "format": audio_ext,
+        "profile": profile,
+        "speed": "等待中",
+        "eta": None,
+        "downloaded_bytes": 0,
+        "total_bytes": 0,
+        "retries": 0,
+    }
+    if clip:
+        task["clip"] = {"start": clip[0], "end": clip[1]}
+    if callback_url:
+        task["callback_url"] = callback_url
+        task["base_url"] = (_PUBLIC_BASE_URL or request.host_url).rstrip("/")
+
+    cached = _lookup_result(video_url, audio_ext, clip, profile)
+    if cached:
+        # 结果缓存命中，直接复用已有产物
+        task.update({
+            "status": "finished",
+            "progress": 100.0,
+            "speed": "完成",
+            "eta": 0,
+            "title": cached["title"],
+            "artifact": cached["artifact"],
+            "artifact_url": _artifact_url(cached["artifact"], audio_ext),
+            "size": cached["size"],
+            "cached": True,
+        })
+        _write_task_manifest(task_id, cached["artifact"], audio_ext, cached["title"])
+        with _TASKS_LOCK:
+            _TASKS[task_id] = task
+            _queue_webhook(task)
+        return jsonify({"id": task_id}), 201
+
     with _TASKS_LOCK:
-        _TASKS[task_id] = {
-            "id": task_id,
-            "status": "queued",
-            "progress": 0.0,
-            "created_at": _now_ts(),
-            "expires_at": _now_ts() + _TASK_TTL_SECONDS,
-            "url": video_url,
-            "format": audio_ext,
-            "speed": "等待中",
-            "eta": None,
-            "downloaded_bytes": 0,
-            "total_bytes": 0,
-        }
+        _TASKS[task_id] = task
+        _CANCEL_EVENTS[task_id] = threading.Event()
+        _TASK_PROCESSES[task_id] = ProcessGroup()
 
-    t = threading.Thread(target=_run_download_task, args=(task_id, video_url, audio_ext), daemon=True)
+    t = threading.Thread(target=_run_download_task, args=(task_id, video_url, audio_ext, clip, profile), daemon=True)
     t.start()
 
     return jsonify({"id": task_id}), 201
@@ -356,71 +1626,102 @@ def get_task(task_id: str):
         task = _TASKS.get(task_id)
         if not task:
             return jsonify({"error": "task not found"}), 404
+        # 记录最近一次被查询的时间，用于检测客户端是否已全部断开
+        task["watched_at"] = _now_ts()
         # do not leak file path
-        public = {k: v for k, v in task.items() if k not in ("file_path", "temp_dir")}
+        public = {k: v for k, v in task.items() if k not in _PRIVATE_TASK_FIELDS}
     return jsonify(public)
 
 
+@app.route("/tasks/<task_id>", methods=["DELETE"])
+def delete_task(task_id: str):
+    """取消进行中的任务，或删除已结束的任务"""
+    if _cancel_task(task_id, "cancelled by client"):
+        return jsonify({"id": task_id, "status": "cancelled"}), 202
+    with _TASKS_LOCK:
+        if task_id not in _TASKS:
+            return jsonify({"error": "task not found"}), 404
+    _cleanup_task(task_id)
+    with _TASKS_LOCK:
+        _TASKS.pop(task_id, None)
+    return jsonify({"id": task_id, "status": "deleted"})
+
+
 @app.route("/tasks/<task_id>/play", methods=["GET"])
 def play_task_file(task_id: str):
     """播放音频文件，不会删除文件"""
     with _TASKS_LOCK:
         task = _TASKS.get(task_id)
-        if not task:
+        if task:
+            # 允许已删除状态的任务重新播放（如果文件仍然存在）
+            status = task.get("status")
+            if status not in ["finished", "deleted"]:
+                return jsonify({"error": f"task not ready, status={status}"}), 409
+
+            title = task.get("title") or "audio"
+            audio_ext = task.get("format") or "mp3"
+            digest = task.get("artifact")
+
+    if not task:
+        # 任务可能由其他实例完成，从存储中的任务清单查找
+        manifest = _load_task_manifest(task_id)
+        if not manifest:
             return jsonify({"error": "task not found"}), 404
-        
-        # 允许已删除状态的任务重新播放（如果文件仍然存在）
-        status = task.get("status")
-        if status not in ["finished", "deleted"]:
-            return jsonify({"error": f"task not ready, status={status}"}), 409
-            
-        file_path = task.get("file_path")
-        title = task.get("title") or "audio"
-        audio_ext = task.get("format") or "mp3"
-        mime_type, _ = get_audio_mime_and_ext(audio_ext)
-
-    if not file_path or not os.path.exists(file_path):
-        return jsonify({"error": "file not found"}), 404
+        title = manifest.get("title") or "audio"
+        audio_ext = manifest.get("format") or "mp3"
+        digest = manifest.get("artifact")
 
-    download_name = f"{title}.{audio_ext}"
+    if not digest:
+        return jsonify({"error": "file not found"}), 404
 
-    return send_file(
-        file_path,
-        mimetype=mime_type,
+    return _send_artifact(
+        digest,
+        audio_ext,
+        download_name=f"{title}.{audio_ext}",
         as_attachment=False,  # 不强制下载
-        download_name=download_name,
-        conditional=True,
-        etag=True,
-        max_age=0,
     )
 
 
+@app.route("/artifacts/<name>", methods=["GET"])
+def get_artifact(name: str):
+    """按内容哈希提供音频，URL 与内容一一对应，可永久缓存"""
+    match = _ARTIFACT_NAME_RE.match(name)
+    if not match:
+        return jsonify({"error": "artifact not found"}), 404
+    # 产物可能由其他实例写入，不要求在本实例登记过
+    return _send_artifact(match.group(1), match.group(2), immutable=True)
+
+
 @app.route("/tasks/<task_id>/download", methods=["GET"])
 def download_task_file(task_id: str):
     with _TASKS_LOCK:
         task = _TASKS.get(task_id)
-        if not task:
+        if task:
+            # 允许已删除状态的任务重新下载（如果文件仍然存在）
+            status = task.get("status")
+            if status not in ["finished", "deleted"]:
+                return jsonify({"error": f"task not ready, status={status}"}), 409
+
+            title = task.get("title") or "audio"
+            audio_ext = task.get("format") or "mp3"
+            digest = task.get("artifact")
+
+            # 如果任务已经是删除状态，不需要再次标记
+            if status == "finished":
+                task["status"] = "deleted"
+                # 不立即设置 expires_at，让清理线程延迟处理
+
+    if not task:
+        # 任务可能由其他实例完成，从存储中的任务清单查找
+        manifest = _load_task_manifest(task_id)
+        if not manifest:
             return jsonify({"error": "task not found"}), 404
-        
-        # 允许已删除状态的任务重新下载（如果文件仍然存在）
-        status = task.get("status")
-        if status not in ["finished", "deleted"]:
-            return jsonify({"error": f"task not ready, status={status}"}), 409
-            
-        file_path = task.get("file_path")
-        title = task.get("title") or "audio"
-        audio_ext = task.get("format") or "mp3"
-        mime_type, _ = get_audio_mime_and_ext(audio_ext)
-        
-        # 如果任务已经是删除状态，不需要再次标记
-        if status == "finished":
-            task["status"] = "deleted"
-            # 不立即设置 expires_at，让清理线程延迟处理
-
-    if not file_path or not os.path.exists(file_path):
-        return jsonify({"error": "file not found"}), 404
+        title = manifest.get("title") or "audio"
+        audio_ext = manifest.get("format") or "mp3"
+        digest = manifest.get("artifact")
 
-    download_name = f"{title}.{audio_ext}"
+    if not digest:
+        return jsonify({"error": "file not found"}), 404
 
     # send file, then cleanup
     from flask import after_this_request
@@ -432,23 +1733,84 @@ def download_task_file(task_id: str):
         finally:
             return response
 
-    return send_file(
-        file_path,
-        mimetype=mime_type,
+    return _send_artifact(
+        digest,
+        audio_ext,
+        download_name=f"{title}.{audio_ext}",
         as_attachment=True,
-        download_name=download_name,
-        conditional=True,
-        etag=True,
-        max_age=0,
     )
 
 
-# 启动清理线程
-_janitor = threading.Thread(target=_janitor_loop, daemon=True)
-_janitor.start()
+def _estimator_stats() -> dict:
+    """估算耗时与实际耗时的对比：ratio 为 实际/估算，error 为绝对误差（秒）"""
+    samples = list(_COST_SAMPLES)
+    if not samples:
+        return {"samples": 0}
+    ratios = sorted(actual / expected for expected, actual in samples if expected > 0)
+    errors = [abs(actual - expected) for expected, actual in samples]
+    return {
+        "samples": len(samples),
+        "median_ratio": round(ratios[len(ratios) // 2], 3),
+        "p90_ratio": round(ratios[int(len(ratios) * 0.9)], 3),
+        "mean_abs_error": round(sum(errors) / len(errors), 1),
+    }
+
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    now = _now_ts()
+    with _TASKS_LOCK:
+        top = sorted(
+            ({"key": key, "score": round(_decayed_score(e, now), 3)} for key, e in _POPULARITY.items()),
+            key=lambda item: item["score"],
+            reverse=True,
+        )[:max(_PREWARM_TOP_N, 10)]
+        stats = {
+            "popularity": top,
+            "result_cache_size": len(_RESULT_CACHE),
+            "artifacts": {
+                "count": len(_ARTIFACTS),
+                "bytes": sum(a["size"] for a in _ARTIFACTS.values()),
+            },
+            "prewarm": dict(_PREWARM_STATE),
+        }
+        stats["scheduler"] = {
+            "max_concurrent": _MAX_CONCURRENT_TASKS,
+            "running": len(_SCHED_RUNNING),
+            "running_long": sum(1 for is_long in _SCHED_RUNNING.values() if is_long),
+            "queued": len(_SCHED_QUEUE),
+            "estimator": _estimator_stats(),
+        }
+    stats["circuit_breakers"] = breaker_snapshots()
+    stats["credentials"] = _CREDENTIALS.snapshot()
+    if _WEBHOOKS is not None:
+        stats["webhooks"] = _WEBHOOKS.snapshot()
+    return jsonify(stats)
+
+
+def _startup():
+    """加载持久化状态、恢复断点并启动后台线程；只在作为服务运行时调用，导入模块（如测试）不会接手 WORK_DIR 中的任务"""
+    _load_artifacts()
+    _load_popularity()
+    _load_credentials()
+    _restore_checkpoints()
+
+    # 启动清理线程
+    threading.Thread(target=_janitor_loop, daemon=True).start()
+
+    # 启动取消检测线程
+    if _WATCH_TIMEOUT_SECONDS > 0:
+        threading.Thread(target=_watchdog_loop, daemon=True).start()
+
+    # 启动预热线程
+    if _PREWARM_TOP_N > 0:
+        threading.Thread(target=_prewarm_loop, daemon=True).start()
 
 
 if __name__ == "__main__":
+    _startup()
+    # Cloud Run 缩容或重新部署时先发送 SIGTERM
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     # 支持 Cloud Run 的 PORT 环境变量
     port = int(os.environ.get("PORT", 9000))
     app.run(host="0.0.0.0", port=port) 
\ No newline at end of file
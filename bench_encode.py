@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+编码预设基准测试
+
+用 ffmpeg 生成合成音频（正弦波 + 粉红噪声），按 config.ENCODER_PROFILES 中的
+每个格式 × 预设执行一次转码，统计墙钟时间、CPU 时间和输出大小。
+
+用法：
+    python3 bench_encode.py                     # 10 分钟合成音频，全部格式和预设
+    python3 bench_encode.py --duration 1800     # 30 分钟
+    python3 bench_encode.py --format mp3 --profile voice --json
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from config import AUDIO_FORMATS, ENCODER_PROFILES
+from encoding import FFMPEG, run_ffmpeg, transcode
+
+
+def generate_source(path: str, duration: int, silence_every: int = 0):
+    """生成 48kHz 立体声音频：左右声道不同频率的正弦波叠加粉红噪声
+
+    .wav 输出 PCM，其他扩展名输出 160k Opus（与 YouTube 常见音轨相近）；
+    silence_every 大于 0 时每隔该秒数插入 1 秒静音，模拟曲目或段落间隔
+    """
+    mix = "[s][n]amix=inputs=2:normalize=0"
+    if silence_every:
+        mix += f",volume=volume=0:enable='lt(mod(t,{silence_every}),1)'"
+    codec = ["-c:a", "pcm_s16le"] if path.endswith(".wav") else ["-c:a", "libopus", "-b:a", "160k"]
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=660:sample_rate=48000:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:sample_rate=48000:amplitude=0.1:duration={duration}",
+        "-filter_complex", "[0:a][1:a]amerge=inputs=2[s];[2:a]aformat=channel_layouts=stereo[n];"
+                           f"{mix}[out]",
+        "-map", "[out]",
+        *codec,
+        path,
+    ])
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench_one(src_path: str, out_dir: str, audio_ext: str, profile: str) -> dict:
+    dst_path = os.path.join(out_dir, f"{profile}.{audio_ext}")
+    cpu_before = _children_cpu()
+    wall_before = time.perf_counter()
+    transcode(src_path, dst_path, audio_ext, profile)
+    wall = time.perf_counter() - wall_before
+    cpu = _children_cpu() - cpu_before
+    size = os.path.getsize(dst_path)
+    os.remove(dst_path)
+    return {
+        "format": audio_ext,
+        "profile": profile,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "size_bytes": size,
+    }
+
+
+def print_table(results, duration: int):
+    print(f"合成音频时长: {duration} 秒")
+    print(f"{'格式':<6}{'预设':<10}{'墙钟(s)':>10}{'CPU(s)':>10}{'倍速':>10}{'大小(MB)':>10}")
+    for r in results:
+        speed = duration / r["wall_seconds"] if r["wall_seconds"] else 0
+        print(
+            f"{r['format']:<8}{r['profile']:<12}{r['wall_seconds']:>10.2f}{r['cpu_seconds']:>10.2f}"
+            f"{speed:>9.0f}x{r['size_bytes'] / 1024 / 1024:>10.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="编码预设基准测试")
+    parser.add_argument("--duration", type=int, default=600, help="合成音频时长（秒），默认 600")
+    parser.add_argument("--format", action="append", choices=sorted(AUDIO_FORMATS), help="只测试指定格式，可重复")
+    parser.add_argument("--profile", action="append", choices=sorted(ENCODER_PROFILES), help="只测试指定预设，可重复")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    if shutil.which(FFMPEG) is None:
+        parser.error("未找到 ffmpeg，请先安装")
+
+    formats = args.format or list(AUDIO_FORMATS)
+    profiles = args.profile or list(ENCODER_PROFILES)
+    work_dir = tempfile.mkdtemp(prefix="bench_encode_")
+    try:
+        src_path = os.path.join(work_dir, "source.wav")
+        generate_source(src_path, args.duration)
+        results = [
+            bench_one(src_path, work_dir, audio_ext, profile)
+            for audio_ext in formats
+            for profile in profiles
+            if audio_ext in ENCODER_PROFILES[profile]
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"duration": args.duration, "results": results}, indent=2))
+    else:
+        print_table(results, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+分段并行转码基准测试
+
+生成一段带周期性静音的合成长音频（Opus，与 YouTube 音轨相近），分别用单进程转码和
+不同进程数的分段并行转码（encoding.transcode_segmented）编码，统计墙钟时间、CPU 时间、
+相对单进程的加速比，以及输出时长与源时长的差值（各段编码器延迟和填充累积的漂移）。
+切分点附近没有静音时 transcode_segmented 退回单进程转码，结果中 segmented 为 false；
+--silence-every 0 可以验证这一点。
+
+用法：
+    python3 bench_segmented.py                          # 1 小时音频，进程数 1,2,4,... 直到 CPU 数
+    python3 bench_segmented.py --duration 10800 --workers 1 --workers 8
+    python3 bench_segmented.py --format opus --profile voice --json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from bench_encode import _children_cpu, generate_source
+from config import AUDIO_FORMATS, ENCODER_PROFILES
+from encoding import FFMPEG, FFPROBE, probe_duration, transcode, transcode_segmented
+
+
+def _default_workers():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def bench_one(src_path: str, out_dir: str, audio_ext: str, profile: str, workers: int, duration: float) -> dict:
+    dst_path = os.path.join(out_dir, f"out_{workers}.{audio_ext}")
+    cpu_before = _children_cpu()
+    wall_before = time.perf_counter()
+    if workers == 1:
+        transcode(src_path, dst_path, audio_ext, profile)
+        segmented = False
+    else:
+        segmented = transcode_segmented(src_path, dst_path, audio_ext, profile, workers=workers, duration=duration)
+    wall = time.perf_counter() - wall_before
+    cpu = _children_cpu() - cpu_before
+    out_duration = probe_duration(dst_path)
+    size = os.path.getsize(dst_path)
+    os.remove(dst_path)
+    return {
+        "workers": workers,
+        "segmented": segmented,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "size_bytes": size,
+        "duration_diff_ms": round((out_duration - duration) * 1000, 1) if out_duration else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分段并行转码基准测试")
+    parser.add_argument("--duration", type=int, default=3600, help="合成音频时长（秒），默认 3600")
+    parser.add_argument("--format", default="mp3", choices=sorted(AUDIO_FORMATS), help="输出格式，默认 mp3")
+    parser.add_argument("--profile", default="default", choices=sorted(ENCODER_PROFILES), help="编码预设")
+    parser.add_argument("--workers", type=int, action="append", help="测试的进程数，可重复，默认 1,2,4,... 直到 CPU 数")
+    parser.add_argument("--silence-every", type=int, default=90, help="每隔多少秒插入 1 秒静音，0 表示不插入")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    if shutil.which(FFMPEG) is None or shutil.which(FFPROBE) is None:
+        parser.error("未找到 ffmpeg / ffprobe，请先安装")
+
+    worker_counts = sorted(set(args.workers or _default_workers()))
+    if worker_counts[0] != 1:
+        # 加速比以单进程为基准
+        worker_counts.insert(0, 1)
+    work_dir = tempfile.mkdtemp(prefix="bench_segmented_")
+    try:
+        src_path = os.path.join(work_dir, "source.opus")
+        generate_source(src_path, args.duration, silence_every=args.silence_every)
+        duration = probe_duration(src_path) or float(args.duration)
+        results = [
+            bench_one(src_path, work_dir, args.format, args.profile, workers, duration)
+            for workers in worker_counts
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = results[0]["wall_seconds"]
+    for r in results:
+        r["speedup"] = round(baseline / r["wall_seconds"], 2) if r["wall_seconds"] else None
+
+    if args.json:
+        print(json.dumps({
+            "duration": args.duration,
+            "format": args.format,
+            "profile": args.profile,
+            "cpu_count": os.cpu_count(),
+            "results": results,
+        }, indent=2))
+        return
+
+    print(f"合成音频时长: {args.duration} 秒，格式: {args.format}，预设: {args.profile}，CPU 数: {os.cpu_count()}")
+    print(f"{'进程数':<6}{'墙钟(s)':>10}{'CPU(s)':>10}{'加速比':>8}{'大小(MB)':>10}{'时长差(ms)':>12}{'分段':>6}")
+    for r in results:
+        diff = "-" if r["duration_diff_ms"] is None else f"{r['duration_diff_ms']:.1f}"
+        print(
+            f"{r['workers']:<9}{r['wall_seconds']:>10.2f}{r['cpu_seconds']:>10.2f}{r['speedup']:>9.2f}x"
+            f"{r['size_bytes'] / 1024 / 1024:>10.2f}{diff:>12}{'是' if r['segmented'] else '否':>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,27 +10,21 @@ YT_DLP_CONFIG = {
     "no_warnings": True,
     "format": "bestaudio/best",
     
-    # 音频处理
-    "audio_quality": "192",
-    
-    # Cookies 设置
-    "cookiefile": "cookies.txt",  # cookies 文件路径
+    # Cookies 不在这里设置：由 credentials.py 的身份池加载并按任务分配，见 CREDENTIAL_CONFIG
     
     # 用户代理和请求头
     "http_headers": {
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     },
     
-    # 重试设置
-    "extractor_retries": 3,
+    # 重试设置：yt-dlp 内部只负责单次请求/分片的快速重试（退避时间见 app.py 的
+    # retry_sleep_functions），整个任务级别的重试、退避与熔断由 retry.py 负责。
+    # 不设置 sleep_interval，成功路径上没有任何固定等待
+    "extractor_retries": 1,
     "fragment_retries": 3,
     "retries": 3,
     "file_access_retries": 3,
     
-    # 延迟设置
-    "sleep_interval": 1,
-    "max_sleep_interval": 5,
-    
     # 绕过验证选项
     "no_check_certificate": True,
     "prefer_insecure": True,
@@ -68,21 +62,64 @@ TASK_CONFIG = {
     "deleted_delay_seconds": 300,  # 5 分钟延迟清理
 }
 
+# 身份池配置
+CREDENTIAL_CONFIG = {
+    "cookie_files": ["cookies.txt"],  # get_cookies.py 生成的默认 cookies 文件
+    "cookie_dir": "cookies",  # 目录下每个 *.txt 文件作为一个独立身份，可用 COOKIES_DIR 环境变量覆盖
+    "cooldown_seconds": 300,  # 遇到 429/403 后暂停使用的时间，连续失败时翻倍
+    "max_cooldown_seconds": 3600,
+}
+
 # 音频格式配置
 AUDIO_FORMATS = {
     "mp3": {
         "mime_type": "audio/mpeg",
         "extension": "mp3",
-        "quality": "192"
+        "encoder": "libmp3lame",
     },
     "m4a": {
         "mime_type": "audio/mp4",
         "extension": "m4a",
-        "quality": "192"
+        "encoder": "aac",
     },
     "opus": {
         "mime_type": "audio/ogg",
         "extension": "opus",
-        "quality": "192"
+        "encoder": "libopus",
     }
-} 
\ No newline at end of file
+}
+
+# 编码预设，按格式分别配置：
+#   mode: "cbr" 固定码率（使用 bitrate）或 "vbr" 可变码率（mp3/m4a 使用 quality，opus 使用 bitrate 作为目标码率）
+#   sample_rate / channels: 为 None 时保持源文件的采样率和声道数
+#   threads: 编码线程数，多个任务并发时保持 1 可避免相互争抢 CPU
+#   extra_args: 追加的 ffmpeg 输出参数
+ENCODER_PROFILES = {
+    # 默认：与原来 preferredquality=192 的行为一致
+    "default": {
+        "mp3": {"mode": "cbr", "bitrate": "192k", "sample_rate": None, "channels": None, "threads": 1},
+        "m4a": {"mode": "cbr", "bitrate": "192k", "sample_rate": None, "channels": None, "threads": 1},
+        "opus": {"mode": "vbr", "bitrate": "192k", "sample_rate": None, "channels": None, "threads": 1},
+    },
+    # 音乐：立体声高码率，mp3 使用 VBR 在同等音质下体积更小
+    "music": {
+        "mp3": {"mode": "vbr", "quality": 2, "sample_rate": 44100, "channels": 2, "threads": 1},
+        "m4a": {"mode": "cbr", "bitrate": "256k", "sample_rate": 44100, "channels": 2, "threads": 1},
+        "opus": {"mode": "vbr", "bitrate": "160k", "sample_rate": 48000, "channels": 2, "threads": 1},
+    },
+    # 语音（播客、讲座、直播回放）：单声道低采样率，编码和传输都快数倍
+    "voice": {
+        "mp3": {"mode": "cbr", "bitrate": "48k", "sample_rate": 22050, "channels": 1, "threads": 1},
+        "m4a": {"mode": "cbr", "bitrate": "48k", "sample_rate": 22050, "channels": 1, "threads": 1},
+        "opus": {
+            "mode": "vbr",
+            "bitrate": "24k",
+            "sample_rate": 16000,
+            "channels": 1,
+            "threads": 1,
+            "extra_args": ["-application", "voip"],
+        },
+    },
+}
+
+DEFAULT_ENCODER_PROFILE = "default" 
\ No newline at end of file
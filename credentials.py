@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+ListenTube 身份池
+
+加载多个 cookies 文件，每个文件启动时解析一次并常驻内存，按任务分配：
+- 优先分配最久没有失败的身份，相同时轮询
+- 遇到 429/403 的身份暂停使用一段时间（连续失败时冷却时间翻倍）
+- 没有可用身份时不带 cookies 请求，与未配置 cookies 时行为一致
+"""
+
+import copy
+import glob
+import os
+import threading
+import time
+from typing import List, Optional
+
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+from retry import BLOCKING_ERRORS
+
+
+class Identity:
+    """一个 cookies 文件对应的身份"""
+
+    def __init__(self, name: str, path: str, cookies: list):
+        self.name = name
+        self.path = path
+        self.cookies = cookies
+        self.in_use = 0
+        self.successes = 0
+        self.failures = 0
+        self.strikes = 0  # 连续封禁类失败次数，决定冷却时间
+        self.last_failure = 0.0
+        self.last_assigned = 0
+        self.benched_until = 0.0
+        self.last_error = None
+
+    def apply(self, cookiejar):
+        """把 cookies 复制到 YoutubeDL 实例的 cookiejar，不同任务互不影响"""
+        for cookie in self.cookies:
+            cookiejar.set_cookie(copy.copy(cookie))
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "name": self.name,
+            "cookies": len(self.cookies),
+            "state": "benched" if self.benched_until > now else "available",
+            "benched_for": max(0, round(self.benched_until - now)),
+            "in_use": self.in_use,
+            "successes": self.successes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+def _load_cookie_file(path: str) -> list:
+    jar = YoutubeDLCookieJar(path)
+    jar.load()
+    return list(jar)
+
+
+class CredentialPool:
+    def __init__(self, cooldown: float = 300.0, max_cooldown: float = 3600.0):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._identities: List[Identity] = []
+        self._sequence = 0
+        self._anonymous = 0
+
+    def load(self, paths: List[str]) -> List[str]:
+        """加载 cookies 文件，跳过不存在或无法解析的文件，返回错误信息列表"""
+        identities = []
+        errors = []
+        seen = set()
+        for path in paths:
+            real_path = os.path.realpath(path)
+            if real_path in seen or not os.path.isfile(real_path):
+                continue
+            seen.add(real_path)
+            try:
+                cookies = _load_cookie_file(real_path)
+            except Exception as exc:
+                errors.append(f"{path}: {exc}")
+                continue
+            if cookies:
+                identities.append(Identity(os.path.basename(path), real_path, cookies))
+        with self._lock:
+            self._identities = identities
+        return errors
+
+    def acquire(self, prefer: Optional[Identity] = None) -> Optional[Identity]:
+        """分配一个身份；全部在冷却中或没有配置时返回 None
+
+        prefer 不在冷却中时直接分配它：预检解析出的下载地址属于预检时的会话，下载时沿用同一个身份
+        """
+        now = time.time()
+        with self._lock:
+            available = [i for i in self._identities if i.benched_until <= now]
+            if not available:
+                self._anonymous += 1
+                return None
+            if prefer is not None and prefer in available:
+                identity = prefer
+            else:
+                identity = min(available, key=lambda i: (i.last_failure, i.last_assigned))
+            self._sequence += 1
+            identity.last_assigned = self._sequence
+            identity.in_use += 1
+            return identity
+
+    def release(self, identity: Optional[Identity], error_class: Optional[str] = None, cancelled: bool = False):
+        """归还身份；error_class 为 None 表示成功，cancelled 表示任务被取消或让出，不计入成败"""
+        if identity is None:
+            return
+        now = time.time()
+        with self._lock:
+            identity.in_use = max(0, identity.in_use - 1)
+            if cancelled:
+                return
+            if error_class is None:
+                identity.successes += 1
+                identity.strikes = 0
+                return
+            identity.failures += 1
+            identity.last_error = error_class
+            if error_class not in BLOCKING_ERRORS:
+                # 视频本身或网络的问题，与身份无关
+                return
+            identity.last_failure = now
+            identity.strikes += 1
+            bench = min(self.max_cooldown, self.cooldown * (2 ** (identity.strikes - 1)))
+            identity.benched_until = now + bench
+
+    def available(self) -> int:
+        now = time.time()
+        with self._lock:
+            return sum(1 for i in self._identities if i.benched_until <= now)
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            identities = [i.snapshot(now) for i in self._identities]
+            anonymous = self._anonymous
+        return {
+            "total": len(identities),
+            "available": sum(1 for i in identities if i["state"] == "available"),
+            "anonymous_requests": anonymous,
+            "identities": identities,
+        }
+
+
+def cookie_paths(cookie_files: List[str], cookie_dir: Optional[str]) -> List[str]:
+    """配置中的单个 cookies 文件加上目录下所有 *.txt 文件"""
+    paths = list(cookie_files)
+    if cookie_dir and os.path.isdir(cookie_dir):
+        paths += sorted(glob.glob(os.path.join(cookie_dir, "*.txt")))
+    return paths
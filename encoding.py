@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+ListenTube 音频编码
+
+根据 config.py 中的 AUDIO_FORMATS 与 ENCODER_PROFILES 生成 ffmpeg 参数并执行转码，
+服务端与 bench_encode.py 共用同一套参数。
+
+长音频使用分段并行转码（transcode_segmented）：在静音处把源文件切成若干段，
+每段由独立的 ffmpeg 进程编码，最后用 concat 分离器无损拼接为一个文件。
+"""
+
+import os
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from config import AUDIO_FORMATS, DEFAULT_ENCODER_PROFILE, ENCODER_PROFILES
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+
+# 所有分段编码进程共用的 CPU 槽位，多个任务同时分段转码时总进程数不超过 CPU 数
+_ENCODE_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# 分段边界在目标时间点前后该范围内寻找静音，任一边界找不到静音时改为单进程转码
+_BOUNDARY_SEARCH_SECONDS = 15.0
+_SILENCE_NOISE = "-40dB"
+_SILENCE_MIN_DURATION = 0.3
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[0-9.]+)")
+_MIN_SEGMENT_SECONDS = 60.0
+
+# 源编码与目标格式一致时可以直接复制音频流，不重新编码
+_COPY_COMPATIBLE = {
+    "mp3": ("mp3",),
+    "m4a": ("mp4a", "aac"),
+    "opus": ("opus",),
+}
+
+
+def resolve_profile(audio_ext: str, profile: Optional[str] = None) -> dict:
+    """返回指定格式在某个预设下的编码设置，未知预设抛出 ValueError"""
+    name = profile or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"unknown encoder profile: {name}")
+    settings = ENCODER_PROFILES[name].get(audio_ext)
+    if settings is None:
+        raise ValueError(f"profile {name} does not support format {audio_ext}")
+    return settings
+
+
+def can_copy(audio_ext: str, profile: Optional[str], src_codec: Optional[str]) -> bool:
+    """默认预设下源编码已经是目标编码时直接复制；其他预设需要重采样或改码率，必须重新编码"""
+    if (profile or DEFAULT_ENCODER_PROFILE) != DEFAULT_ENCODER_PROFILE or not src_codec:
+        return False
+    return src_codec.lower().startswith(_COPY_COMPATIBLE.get(audio_ext, ()))
+
+
+def encoder_args(audio_ext: str, settings: dict) -> List[str]:
+    """把编码设置转换为 ffmpeg 输出参数"""
+    codec = AUDIO_FORMATS[audio_ext]["encoder"]
+    args = ["-vn", "-c:a", codec]
+    mode = settings.get("mode", "cbr")
+    if codec == "libopus":
+        args += ["-b:a", settings["bitrate"], "-vbr", "on" if mode == "vbr" else "off"]
+    elif mode == "vbr":
+        args += ["-q:a", str(settings["quality"])]
+    else:
+        args += ["-b:a", settings["bitrate"]]
+    if settings.get("sample_rate"):
+        args += ["-ar", str(settings["sample_rate"])]
+    if settings.get("channels"):
+        args += ["-ac", str(settings["channels"])]
+    if settings.get("threads") is not None:
+        args += ["-threads", str(settings["threads"])]
+    args += list(settings.get("extra_args") or [])
+    return args
+
+
+def container_args(audio_ext: str) -> List[str]:
+    if audio_ext == "m4a":
+        # moov 放在文件头，浏览器可以边下边播
+        return ["-movflags", "+faststart"]
+    return []
+
+
+class ProcessGroup:
+    """一个任务启动的 ffmpeg 进程；取消任务时 kill() 直接终止这些进程，不依赖 /proc 等平台特性"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = set()
+        self.killed = False
+
+    def add(self, proc: subprocess.Popen):
+        with self._lock:
+            if not self.killed:
+                self._procs.add(proc)
+                return
+        # 已经取消：之后启动的进程立即终止
+        proc.kill()
+
+    def discard(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def kill(self):
+        with self._lock:
+            self.killed = True
+            procs = list(self._procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+
+
+def run_ffmpeg(args: List[str], group: Optional[ProcessGroup] = None):
+    """执行 ffmpeg，失败时抛出 RuntimeError 并带上最后一行错误输出；group 用于取消时终止进程"""
+    cmd = [FFMPEG, "-y", "-hide_banner", "-loglevel", "error", "-nostdin", *args]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if group is not None:
+        group.add(proc)
+    try:
+        _, stderr = proc.communicate()
+    finally:
+        if group is not None:
+            group.discard(proc)
+    if proc.returncode != 0:
+        lines = (stderr or "").strip().splitlines()
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {lines[-1] if lines else 'no output'}")
+
+
+def transcode(src_path: str, dst_path: str, audio_ext: str, profile: Optional[str] = None,
+              src_codec: Optional[str] = None, input_args: List[str] = (), output_args: List[str] = (),
+              group: Optional[ProcessGroup] = None):
+    """把 src_path 转码为 audio_ext 格式写入 dst_path"""
+    if can_copy(audio_ext, profile, src_codec):
+        codec_args = ["-vn", "-c:a", "copy"]
+    else:
+        codec_args = encoder_args(audio_ext, resolve_profile(audio_ext, profile))
+    run_ffmpeg([
+        *input_args,
+        "-i", src_path,
+        "-map", "0:a:0",
+        *codec_args,
+        *container_args(audio_ext),
+        *output_args,
+        dst_path,
+    ], group)
+
+
+def probe_duration(path: str) -> Optional[float]:
+    """用 ffprobe 读取时长（秒），失败时返回 None"""
+    result = subprocess.run(
+        [FFPROBE, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def _find_boundary(src_path: str, target: float) -> Optional[float]:
+    """在 target 附近寻找静音段，返回离 target 最近的静音中点，找不到时返回 None"""
+    start = max(0.0, target - _BOUNDARY_SEARCH_SECONDS)
+    cmd = [
+        FFMPEG, "-hide_banner", "-nostdin", "-nostats",
+        "-ss", f"{start:.3f}", "-t", f"{_BOUNDARY_SEARCH_SECONDS * 2:.3f}", "-i", src_path,
+        "-map", "0:a:0", "-af", f"silencedetect=n={_SILENCE_NOISE}:d={_SILENCE_MIN_DURATION}",
+        "-f", "null", "-",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    candidates = []
+    silence_start = None
+    for kind, value in _SILENCE_RE.findall(result.stderr or ""):
+        if kind == "start":
+            silence_start = float(value)
+        elif silence_start is not None:
+            # 输出中的时间相对于 -ss 之后的起点
+            candidates.append(start + (silence_start + float(value)) / 2)
+            silence_start = None
+    return min(candidates, key=lambda t: abs(t - target)) if candidates else None
+
+
+def plan_segments(src_path: str, duration: float, segments: int) -> Optional[List[tuple]]:
+    """把 [0, duration) 切成 segments 段，返回 [(start, end)]；任一边界附近没有静音时返回 None"""
+    targets = [duration * i / segments for i in range(1, segments)]
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+        boundaries = list(pool.map(lambda t: _find_boundary(src_path, t), targets))
+    if any(b is None for b in boundaries):
+        return None
+    boundaries.sort()
+    points = [0.0] + boundaries + [duration]
+    return [(points[i], points[i + 1]) for i in range(segments) if points[i + 1] > points[i]]
+
+
+def _encode_segment(src_path: str, dst_path: str, start: float, end: float, codec_args: List[str],
+                    on_progress: Callable[[float], None], procs: list, failed: threading.Event,
+                    group: Optional[ProcessGroup] = None):
+    cmd = [
+        FFMPEG, "-y", "-hide_banner", "-loglevel", "error", "-nostdin",
+        # -ss 放在 -i 之前：快速定位后解码丢弃到精确位置，每段只读取自己的数据
+        "-ss", f"{start:.6f}", "-i", src_path, "-t", f"{end - start:.6f}",
+        "-map", "0:a:0", *codec_args,
+        "-progress", "pipe:1", "-nostats",
+        dst_path,
+    ]
+    with _ENCODE_SLOTS:
+        if failed.is_set():
+            return
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        procs.append(proc)
+        if group is not None:
+            group.add(proc)
+        try:
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and value.isdigit():
+                    on_progress(int(value) / 1000000)
+            stderr = proc.stderr.read()
+            proc.wait()
+        finally:
+            if group is not None:
+                group.discard(proc)
+    if proc.returncode != 0:
+        failed.set()
+        lines = (stderr or "").strip().splitlines()
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {lines[-1] if lines else 'no output'}")
+    on_progress(end - start)
+
+
+def transcode_segmented(src_path: str, dst_path: str, audio_ext: str, profile: Optional[str] = None,
+                        workers: Optional[int] = None, duration: Optional[float] = None,
+                        progress: Optional[Callable[[float], None]] = None,
+                        group: Optional[ProcessGroup] = None) -> bool:
+    """分段并行转码 src_path，结果与 transcode 相同；progress 接收 0-100 的整体进度
+
+    每段单独编码时编码器会在段首尾引入几十毫秒的延迟和填充，只有全部边界都落在静音中时
+    才分段（填充也是静音，拼接点听不出来），否则单进程转码；返回是否实际分段
+    """
+    duration = duration or probe_duration(src_path)
+    workers = workers or os.cpu_count() or 1
+    segments = min(workers, int((duration or 0) // _MIN_SEGMENT_SECONDS))
+    plan = plan_segments(src_path, duration, segments) if segments >= 2 else None
+    if plan is None:
+        transcode(src_path, dst_path, audio_ext, profile, group=group)
+        return False
+
+    settings = dict(resolve_profile(audio_ext, profile), threads=1)
+    codec_args = encoder_args(audio_ext, settings)
+    segments = plan
+    work_dir = os.path.dirname(os.path.abspath(dst_path))
+    base = os.path.splitext(os.path.basename(dst_path))[0]
+    seg_paths = [os.path.join(work_dir, f"{base}.seg{i:03d}.{audio_ext}") for i in range(len(segments))]
+
+    done = [0.0] * len(segments)
+    lock = threading.Lock()
+
+    def _progress_for(index):
+        def _update(seconds):
+            with lock:
+                done[index] = min(seconds, segments[index][1] - segments[index][0])
+                percent = sum(done) / duration * 100
+            if progress is not None:
+                progress(min(percent, 100.0))
+        return _update
+
+    procs = []
+    failed = threading.Event()
+    list_path = os.path.join(work_dir, f"{base}.segments.txt")
+    try:
+        with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+            futures = [
+                pool.submit(_encode_segment, src_path, seg_path, start, end, codec_args,
+                            _progress_for(i), procs, failed, group)
+                for i, ((start, end), seg_path) in enumerate(zip(segments, seg_paths))
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                # 一段失败后终止其余编码进程
+                failed.set()
+                for proc in procs:
+                    if proc.poll() is None:
+                        proc.kill()
+                raise
+        with open(list_path, "w") as f:
+            for seg_path in seg_paths:
+                escaped = seg_path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        # concat 分离器按包拼接，-c copy 不重新编码
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-map", "0:a:0", "-c", "copy",
+            *container_args(audio_ext),
+            dst_path,
+        ], group)
+    finally:
+        for path in seg_paths + [list_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return True
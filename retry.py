@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+ListenTube 重试与熔断
+
+按失败类型决定是否重试以及退避时间，只有失败时才会等待；
+按提取器（站点）维护熔断器，上游明显在封禁时直接快速失败。
+"""
+
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+# 失败类型
+THROTTLED = "throttled"  # HTTP 429，被限流
+FORBIDDEN = "forbidden"  # HTTP 403 或人机验证，身份被拒绝
+NETWORK = "network"  # 连接重置、超时等瞬时网络问题
+EXTRACTOR = "extractor"  # 页面解析失败，可能是上游临时变化
+FATAL = "fatal"  # 视频不存在、私有等，重试没有意义
+UNKNOWN = "unknown"  # 未能识别的失败，少量重试
+
+RetryPolicy = namedtuple("RetryPolicy", ["max_attempts", "base_delay", "max_delay"])
+
+RETRY_POLICIES = {
+    THROTTLED: RetryPolicy(max_attempts=4, base_delay=5.0, max_delay=60.0),
+    FORBIDDEN: RetryPolicy(max_attempts=2, base_delay=2.0, max_delay=10.0),
+    NETWORK: RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=15.0),
+    EXTRACTOR: RetryPolicy(max_attempts=2, base_delay=2.0, max_delay=10.0),
+    FATAL: RetryPolicy(max_attempts=1, base_delay=0.0, max_delay=0.0),
+    UNKNOWN: RetryPolicy(max_attempts=2, base_delay=2.0, max_delay=10.0),
+}
+
+# 计入熔断的失败类型：说明上游在拒绝我们，而不是单个视频的问题
+BLOCKING_ERRORS = (THROTTLED, FORBIDDEN)
+
+_FATAL_PATTERNS = re.compile(
+    r"video unavailable|private video|this video is not available|has been removed|"
+    r"unsupported url|is not a valid url|members-only|copyright|beyond the video duration",
+    re.IGNORECASE,
+)
+_FORBIDDEN_PATTERNS = re.compile(r"sign in to confirm|confirm you.re not a bot", re.IGNORECASE)
+_SERVER_ERROR_RE = re.compile(r"HTTP Error (5\d\d|408)\b")
+_NETWORK_PATTERNS = re.compile(
+    r"connection reset|connection aborted|connection refused|timed out|timeout|"
+    r"remote end closed|remotedisconnected|incompleteread|temporary failure in name resolution|"
+    r"network is unreachable|broken pipe|\bssl\b",
+    re.IGNORECASE,
+)
+
+
+def _error_chain(exc):
+    """展开 yt-dlp 包装过的异常：DownloadError.exc_info、ExtractorError.cause 以及 __cause__"""
+    seen = []
+    pending = [exc]
+    while pending and len(seen) < 10:
+        current = pending.pop(0)
+        if current is None or any(current is s for s in seen):
+            continue
+        seen.append(current)
+        exc_info = getattr(current, "exc_info", None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1:
+            pending.append(exc_info[1])
+        cause = getattr(current, "cause", None)
+        if isinstance(cause, BaseException):
+            pending.append(cause)
+        pending.append(current.__cause__)
+    return seen
+
+
+def classify_error(exc) -> str:
+    """FATAL 只用于明确识别出的不可恢复错误，无法识别的错误归为 UNKNOWN"""
+    chain = _error_chain(exc)
+    for current in chain:
+        status = getattr(current, "status", None)
+        if status == 429:
+            return THROTTLED
+        if status == 403:
+            return FORBIDDEN
+        if isinstance(status, int) and (status >= 500 or status == 408):
+            return NETWORK
+    message = " ".join(str(current) for current in chain)
+    if "HTTP Error 429" in message or "Too Many Requests" in message:
+        return THROTTLED
+    if "HTTP Error 403" in message or _FORBIDDEN_PATTERNS.search(message):
+        return FORBIDDEN
+    if _SERVER_ERROR_RE.search(message):
+        return NETWORK
+    if _FATAL_PATTERNS.search(message):
+        return FATAL
+    if any(isinstance(current, (ConnectionError, TimeoutError)) for current in chain):
+        return NETWORK
+    if _NETWORK_PATTERNS.search(message):
+        return NETWORK
+    if any(type(current).__name__ == "ExtractorError" for current in chain):
+        return EXTRACTOR
+    return UNKNOWN
+
+
+def backoff_delay(policy: RetryPolicy, attempt: int) -> float:
+    """第 attempt 次失败后的等待时间：指数增长，取一半固定加一半随机抖动"""
+    ceiling = min(policy.max_delay, policy.base_delay * (2 ** max(attempt - 1, 0)))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def extractor_key(video_url: str) -> str:
+    host = (urlparse(video_url or "").hostname or "").lower()
+    if host.endswith("youtube.com") or host.endswith("youtu.be"):
+        return "youtube"
+    return host or "generic"
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器打开时直接拒绝请求"""
+
+
+class CircuitBreaker:
+    """连续出现 failure_threshold 次封禁类失败后打开，cooldown 秒后放行一次试探请求"""
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 120.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.time()
+            if now - self._opened_at < self.cooldown:
+                return False
+            # 半开：只放行一个试探请求；试探迟迟没有结果时再放行下一个
+            if self._probe_started is not None and now - self._probe_started < self.cooldown:
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self, error_class: str):
+        with self._lock:
+            probing = self._probe_started is not None
+            self._probe_started = None
+            if error_class not in BLOCKING_ERRORS:
+                # 非封禁类失败不影响熔断状态
+                return
+            self._failures += 1
+            if probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            if self._opened_at is None:
+                state = "closed"
+            elif time.time() - self._opened_at < self.cooldown:
+                state = "open"
+            else:
+                state = "half_open"
+            return {"state": state, "consecutive_failures": self._failures}
+
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(key: str) -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        breaker = _BREAKERS.get(key)
+        if breaker is None:
+            breaker = _BREAKERS[key] = CircuitBreaker()
+        return breaker
+
+
+def breaker_snapshots() -> dict:
+    with _BREAKERS_LOCK:
+        breakers = dict(_BREAKERS)
+    return {key: breaker.snapshot() for key, breaker in breakers.items()}
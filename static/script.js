@@ -6,6 +6,7 @@ let progressInterval = null;
 const elements = {
   asyncUrl: document.getElementById("asyncUrl"),
   asyncFormat: document.getElementById("asyncFormat"),
+  asyncProfile: document.getElementById("asyncProfile"),
   createTaskBtn: document.getElementById("createTaskBtn"),
   taskList: document.getElementById("taskList"),
   tasksContainer: document.getElementById("tasksContainer"),
@@ -57,14 +58,14 @@ const utils = {
 
 // API 调用函数
 const api = {
-  async createTask(url, format) {
+  async createTask(url, format, profile) {
     try {
       const response = await fetch("/tasks", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ url, format }),
+        body: JSON.stringify({ url, format, profile }),
       });
 
       if (!response.ok) {
@@ -95,6 +96,21 @@ const api = {
     }
   },
 
+  async cancelTask(taskId) {
+    try {
+      const response = await fetch(`/tasks/${taskId}`, { method: "DELETE" });
+
+      if (!response.ok && response.status !== 404) {
+        const error = await response.json();
+        throw new Error(error.error || "取消任务失败");
+      }
+
+      return true;
+    } catch (error) {
+      throw error;
+    }
+  },
+
   async downloadTask(taskId) {
     try {
       const response = await fetch(`/tasks/${taskId}/download`);
@@ -139,6 +155,10 @@ const taskManager = {
   },
 
   removeTask(taskId) {
+    // 通知服务端释放资源，失败不影响本地移除
+    api.cancelTask(taskId).catch((error) => {
+      console.error("删除任务失败:", error);
+    });
     tasks.delete(taskId);
     this.renderTasks();
 
@@ -216,6 +236,7 @@ const taskManager = {
       error: "出错",
       expired: "已过期",
       deleted: "已删除",
+      cancelled: "已取消",
     };
     return statusMap[status] || status;
   },
@@ -235,7 +256,15 @@ const taskManager = {
                     </button>
                 </div>
             `;
-    } else if (task.status === "error") {
+    } else if (task.status === "queued" || task.status === "downloading") {
+      return `
+                <div class="task-actions">
+                    <button class="btn btn-small btn-danger" onclick="taskManager.cancelTask('${taskId}')">
+                        <i class="fas fa-stop"></i> 取消
+                    </button>
+                </div>
+            `;
+    } else if (task.status === "error" || task.status === "cancelled") {
       return `
                 <div class="tasks-actions">
                     <button class="btn btn-small btn-danger" onclick="taskManager.removeTask('${taskId}')">
@@ -297,6 +326,16 @@ const taskManager = {
     }
   },
 
+  async cancelTask(taskId) {
+    try {
+      await api.cancelTask(taskId);
+      this.updateTask(taskId, { status: "cancelled", speed: "已取消", eta: null });
+      utils.showStatus("任务已取消", "info");
+    } catch (error) {
+      utils.showStatus(error.message, "error");
+    }
+  },
+
   async playAudio(taskId) {
     try {
       const task = tasks.get(taskId);
@@ -326,14 +365,16 @@ const taskManager = {
         </button>
       </div>
       <audio controls preload="metadata" style="width: 100%;">
-        <source src="/tasks/${taskId}/play" type="audio/${task.format}">
+        <source src="${
+          task.artifact_url || `/tasks/${taskId}/play`
+        }" type="audio/${task.format}">
         您的浏览器不支持音频播放
       </audio>
       <div class="player-info">
         <span>格式: ${task.format.toUpperCase()}</span>
         <span>大小: ${
-          task.downloaded_bytes
-            ? utils.formatBytes(task.downloaded_bytes)
+          task.size || task.downloaded_bytes
+            ? utils.formatBytes(task.size || task.downloaded_bytes)
             : "未知"
         }</span>
       </div>
@@ -368,6 +409,7 @@ const eventHandlers = {
   async handleCreateTask() {
     const url = elements.asyncUrl.value.trim();
     const format = elements.asyncFormat.value;
+    const profile = elements.asyncProfile.value;
 
     if (!utils.validateUrl(url)) {
       utils.showStatus("请输入有效的 YouTube 链接", "error");
@@ -378,7 +420,7 @@ const eventHandlers = {
       utils.showLoading();
       elements.createTaskBtn.disabled = true;
 
-      const taskId = await api.createTask(url, format);
+      const taskId = await api.createTask(url, format, profile);
 
       // 添加任务到列表
       taskManager.addTask(taskId, {
@@ -388,6 +430,7 @@ const eventHandlers = {
         created_at: Date.now() / 1000,
         url: url,
         format: format,
+        profile: profile,
         speed: "等待中",
         eta: null,
         downloaded_bytes: 0,
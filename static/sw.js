@@ -1,6 +1,8 @@
 const CACHE_NAME = "listentube-v1";
-const STATIC_CACHE = "listentube-static-v1";
-const AUDIO_CACHE = "listentube-audio-v1";
+const STATIC_CACHE = "listentube-static-v3";
+// 内容寻址的音频（/artifacts/<sha256>.<ext>），内容不可变，缓存后永不重新验证
+const ARTIFACT_CACHE = "listentube-artifacts-v1";
+const ARTIFACT_CACHE_LIMIT = 50;
 
 // 需要缓存的静态资源
 const STATIC_FILES = [
@@ -20,13 +22,13 @@ self.addEventListener("install", (event) => {
   );
 });
 
-// 激活时清理旧缓存
+// 激活时清理旧缓存（包括旧版本按任务 URL 缓存音频的 listentube-audio-v1）
 self.addEventListener("activate", (event) => {
   event.waitUntil(
     caches.keys().then((cacheNames) => {
       return Promise.all(
         cacheNames.map((cacheName) => {
-          if (cacheName !== STATIC_CACHE && cacheName !== AUDIO_CACHE) {
+          if (cacheName !== STATIC_CACHE && cacheName !== ARTIFACT_CACHE) {
             return caches.delete(cacheName);
           }
         })
@@ -40,18 +42,9 @@ self.addEventListener("fetch", (event) => {
   const { request } = event;
   const url = new URL(request.url);
 
-  // 处理音频文件下载请求
-  if (
-    url.pathname.startsWith("/tasks/") &&
-    url.pathname.endsWith("/download")
-  ) {
-    event.respondWith(handleAudioDownload(request));
-    return;
-  }
-
-  // 处理音频文件播放请求
-  if (url.pathname.startsWith("/tasks/") && url.pathname.endsWith("/play")) {
-    event.respondWith(handleAudioPlay(request));
+  // 处理内容寻址的音频请求
+  if (url.pathname.startsWith("/artifacts/")) {
+    event.respondWith(handleArtifact(event, request));
     return;
   }
 
@@ -61,7 +54,8 @@ self.addEventListener("fetch", (event) => {
     return;
   }
 
-  // 其他请求直接发送到网络
+  // 其他请求直接发送到网络；任务的 /play、/download URL 每个任务都不同，
+  // 缓存无法复用，可复用的缓存由 handleArtifact 负责
   event.respondWith(fetch(request));
 });
 
@@ -91,59 +85,71 @@ async function handleStaticRequest(request) {
   }
 }
 
-// 处理音频下载请求
-async function handleAudioDownload(request) {
-  try {
-    // 先尝试从网络获取
-    const networkResponse = await fetch(request);
-    if (networkResponse.ok) {
-      // 下载成功后缓存音频文件
-      const cache = await caches.open(AUDIO_CACHE);
-      cache.put(request, networkResponse.clone());
-    }
-    return networkResponse;
-  } catch (error) {
-    // 网络失败时尝试从缓存获取
-    const cachedResponse = await caches.match(request);
-    if (cachedResponse) {
-      return cachedResponse;
-    }
-    throw error;
+// 处理内容寻址的音频请求：缓存优先，命中后不再访问源站
+async function handleArtifact(event, request) {
+  const cache = await caches.open(ARTIFACT_CACHE);
+  // 以不带 Range 的 URL 作为缓存键，所有分段请求共用一份完整文件
+  const cachedResponse = await cache.match(request.url);
+  if (cachedResponse) {
+    return rangeResponse(cachedResponse, request.headers.get("Range"));
+  }
+
+  const networkResponse = await fetch(request);
+  if (networkResponse.status === 200) {
+    event.waitUntil(
+      cache.put(request.url, networkResponse.clone()).then(cleanArtifactCache)
+    );
+  } else if (networkResponse.status === 206) {
+    // 播放器发出的是分段请求，在后台拉取一次完整文件写入缓存
+    event.waitUntil(
+      cache.add(request.url).then(cleanArtifactCache).catch(() => {})
+    );
   }
+  return networkResponse;
 }
 
-// 处理音频播放请求
-async function handleAudioPlay(request) {
-  try {
-    // 先尝试从网络获取
-    const networkResponse = await fetch(request);
-    if (networkResponse.ok) {
-      // 播放成功后缓存音频文件
-      const cache = await caches.open(AUDIO_CACHE);
-      cache.put(request, networkResponse.clone());
-    }
-    return networkResponse;
-  } catch (error) {
-    // 网络失败时尝试从缓存获取
-    const cachedResponse = await caches.match(request);
-    if (cachedResponse) {
-      return cachedResponse;
-    }
-    throw error;
+// 用缓存的完整文件构造分段响应，保证离线时也能拖动进度
+async function rangeResponse(response, rangeHeader) {
+  const match = rangeHeader && /^bytes=(\d*)-(\d*)$/.exec(rangeHeader.trim());
+  if (!match) {
+    return response;
+  }
+  const blob = await response.blob();
+  const size = blob.size;
+  let start;
+  let end;
+  if (match[1] === "") {
+    // bytes=-N 表示最后 N 个字节
+    start = Math.max(size - Number(match[2]), 0);
+    end = size - 1;
+  } else {
+    start = Number(match[1]);
+    end = match[2] === "" ? size - 1 : Math.min(Number(match[2]), size - 1);
   }
+  if (start >= size || start > end) {
+    return new Response(null, {
+      status: 416,
+      headers: { "Content-Range": `bytes */${size}` },
+    });
+  }
+  const headers = new Headers(response.headers);
+  headers.set("Content-Range", `bytes ${start}-${end}/${size}`);
+  headers.set("Content-Length", String(end - start + 1));
+  return new Response(blob.slice(start, end + 1), {
+    status: 206,
+    statusText: "Partial Content",
+    headers,
+  });
 }
 
-// 清理音频缓存（当缓存过大时）
-async function cleanAudioCache() {
-  const cache = await caches.open(AUDIO_CACHE);
+// 清理音频缓存（当缓存过大时），在写入新条目后调用
+async function cleanArtifactCache() {
+  const cache = await caches.open(ARTIFACT_CACHE);
   const keys = await cache.keys();
 
-  // 如果缓存超过 50 个文件，删除最旧的
-  if (keys.length > 50) {
-    const oldestKeys = keys.slice(0, keys.length - 50);
+  // 如果缓存超过上限，删除最早写入的
+  if (keys.length > ARTIFACT_CACHE_LIMIT) {
+    const oldestKeys = keys.slice(0, keys.length - ARTIFACT_CACHE_LIMIT);
     await Promise.all(oldestKeys.map((key) => cache.delete(key)));
   }
 }
-
-// 定期清理音频缓存
-setInterval(cleanAudioCache, 300000); // 每5分钟清理一次
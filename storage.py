@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+ListenTube 产物存储
+
+转换完成的音频通过存储后端保存，任意实例都能按键读取：
+- LocalStorage: 本地文件系统（单实例或挂载共享卷）
+- S3Storage: S3 兼容对象存储（AWS S3、GCS 互操作接口、MinIO 等），需要 boto3
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Iterator, Optional
+
+_CHUNK_SIZE = 256 * 1024
+
+
+class ArtifactStorage:
+    """存储后端接口，键为相对路径，例如 "<sha256>.mp3" 或 "tasks/<id>.json" """
+
+    # 为 True 时由存储自身（如对象存储生命周期规则）负责过期，服务端不主动删除产物
+    manages_expiry = False
+
+    def put(self, key: str, local_path: str):
+        """保存本地文件，之后本地文件可能已被移走，调用方不应再使用它"""
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """读取小对象，不存在时返回 None"""
+        raise NotImplementedError
+
+    def size(self, key: str) -> Optional[int]:
+        """对象大小，不存在时返回 None"""
+        raise NotImplementedError
+
+    def read_range(self, key: str, start: int, stop: int) -> Iterator[bytes]:
+        """流式读取 [start, stop) 区间的字节"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """对象在本机上的路径；远程存储返回 None"""
+        return None
+
+
+class LocalStorage(ArtifactStorage):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"invalid storage key: {key}")
+        return path
+
+    def put(self, key: str, local_path: str):
+        dest_path = self._path(key)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        # 先移动到同目录的临时文件再原子替换，避免读到写了一半的文件；
+        # 同一文件系统内 shutil.move 只是一次重命名
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), prefix=".upload_")
+        os.close(fd)
+        try:
+            shutil.move(local_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def put_bytes(self, key: str, data: bytes):
+        dest_path = self._path(key)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = dest_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, dest_path)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            return None
+
+    def read_range(self, key: str, start: int, stop: int) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+
+class S3Storage(ArtifactStorage):
+    manages_expiry = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region_name: Optional[str] = None, part_size_mb: int = 8):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError as exc:
+            raise RuntimeError("S3 存储需要安装 boto3: pip install boto3") from exc
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+        part_size = part_size_mb * 1024 * 1024
+        # 超过一个分片大小的文件走分片上传，按分片从磁盘流式读取，不整体载入内存
+        self._transfer = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=4,
+        )
+        self._client_error = ClientError
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, exc) -> bool:
+        code = exc.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, key: str, local_path: str):
+        self._client.upload_file(local_path, self.bucket, self._key(key), Config=self._transfer)
+
+    def put_bytes(self, key: str, data: bytes):
+        self._client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            obj = self._client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as exc:
+            if self._is_missing(exc):
+                return None
+            raise
+        return obj["Body"].read()
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client_error as exc:
+            if self._is_missing(exc):
+                return None
+            raise
+        return head["ContentLength"]
+
+    def read_range(self, key: str, start: int, stop: int) -> Iterator[bytes]:
+        # 只向对象存储请求客户端需要的区间，按块转发
+        obj = self._client.get_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Range=f"bytes={start}-{stop - 1}",
+        )
+        body = obj["Body"]
+        try:
+            for chunk in body.iter_chunks(_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+def create_storage(default_root: str) -> ArtifactStorage:
+    """根据环境变量创建存储后端"""
+    backend = (os.environ.get("STORAGE_BACKEND") or "local").strip().lower()
+    if backend == "s3":
+        bucket = os.environ.get("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 需要设置 S3_BUCKET")
+        return S3Storage(
+            bucket,
+            prefix=os.environ.get("S3_PREFIX", "listentube"),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+            region_name=os.environ.get("S3_REGION") or None,
+            part_size_mb=int(os.environ.get("S3_PART_SIZE_MB", 8)),
+        )
+    if backend != "local":
+        raise RuntimeError(f"unknown STORAGE_BACKEND: {backend}")
+    return LocalStorage(default_root)
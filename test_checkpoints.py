@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+断点恢复测试：共享 WORK_DIR 中断点的认领与过期，以及重试时保留 .part 文件
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "_WORK_DIR", str(tmp_path))
+    started = []
+    monkeypatch.setattr(app, "_run_download_task", lambda *args: started.append(args))
+    yield tmp_path, started
+    with app._TASKS_LOCK:
+        for name in os.listdir(tmp_path):
+            app._TASKS.pop(name, None)
+            app._CANCEL_EVENTS.pop(name, None)
+
+
+def _write_checkpoint(root, task_id, age=0.0):
+    task_dir = root / task_id
+    task_dir.mkdir()
+    (task_dir / "audio.webm.part").write_bytes(b"partial")
+    checkpoint = task_dir / app._CHECKPOINT_FILE
+    checkpoint.write_text(json.dumps({"id": task_id, "url": "https://www.youtube.com/watch?v=abc", "format": "opus"}))
+    if age:
+        stamp = time.time() - age
+        os.utime(checkpoint, (stamp, stamp))
+    return task_dir
+
+
+def test_claims_checkpoint_left_by_another_instance(work_dir):
+    root, started = work_dir
+    task_dir = _write_checkpoint(root, "task-foreign")
+    app._restore_checkpoints()
+    assert [args[:3] for args in started] == [("task-foreign", "https://www.youtube.com/watch?v=abc", "opus")]
+    assert app._TASKS["task-foreign"]["status"] == "queued"
+    assert not (task_dir / app._CHECKPOINT_FILE).exists()
+    assert (task_dir / "audio.webm.part").exists()
+
+    # 已认领的断点不会被再次恢复
+    app._restore_checkpoints()
+    assert len(started) == 1
+
+
+def test_expires_abandoned_checkpoint(work_dir):
+    root, started = work_dir
+    task_dir = _write_checkpoint(root, "task-abandoned", age=app._CHECKPOINT_TTL_SECONDS + 60)
+    app._restore_checkpoints()
+    assert started == []
+    assert not task_dir.exists()
+
+
+def test_skips_checkpoints_while_draining(work_dir, monkeypatch):
+    root, started = work_dir
+    _write_checkpoint(root, "task-draining")
+    monkeypatch.setattr(app, "_DRAINING", threading.Event())
+    app._DRAINING.set()
+    app._restore_checkpoints()
+    assert started == []
+
+
+def test_keeps_active_work_dir_with_growing_part_file(work_dir):
+    root, _ = work_dir
+    task_dir = root / "task-active"
+    task_dir.mkdir()
+    (task_dir / "audio.webm.part").write_bytes(b"partial")
+    stamp = time.time() - app._TASK_TTL_SECONDS - 60
+    os.utime(task_dir, (stamp, stamp))
+    app._restore_checkpoints()
+    assert task_dir.exists()
+
+
+def test_import_does_not_claim_checkpoints(tmp_path):
+    task_dir = _write_checkpoint(tmp_path, "task-import")
+    env = dict(os.environ, WORK_DIR=str(tmp_path), ARTIFACT_DIR=str(tmp_path / "artifacts"))
+    subprocess.run([sys.executable, "-c", "import app"], cwd=os.path.dirname(os.path.abspath(app.__file__)),
+                   env=env, check=True)
+    assert (task_dir / app._CHECKPOINT_FILE).exists()
+    assert (task_dir / "audio.webm.part").exists()
+
+
+@pytest.mark.parametrize("error,keeps_part", [
+    (ConnectionResetError("Connection reset by peer"), True),
+    (RuntimeError("HTTP Error 429: Too Many Requests"), True),
+    (RuntimeError("unexpected failure"), False),
+])
+def test_retry_keeps_partial_download_for_network_errors(tmp_path, monkeypatch, error, keeps_part):
+    monkeypatch.setattr(app, "backoff_delay", lambda policy, attempt: 0)
+    seen = []
+
+    def fake_download(video_url, audio_ext, temp_dir, hooks, **kwargs):
+        seen.append(sorted(os.listdir(temp_dir)))
+        if len(seen) == 1:
+            (tmp_path / "audio.webm.part").write_bytes(b"partial")
+            (tmp_path / "audio.webm.ytdl").write_bytes(b"{}")
+            (tmp_path / "audio.info.json").write_bytes(b"{}")
+            raise error
+        return os.path.join(temp_dir, "audio.out.mp3"), "title"
+
+    monkeypatch.setattr(app, "_download_audio", fake_download)
+    # 每组参数使用独立的熔断器
+    url = f"https://retry-{keeps_part}-{type(error).__name__}.example.com/v"
+    app._download_with_retries("task-retry", url, "mp3", str(tmp_path), threading.Event())
+    expected = ["audio.webm.part", "audio.webm.ytdl"] if keeps_part else []
+    assert seen[1] == expected
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+身份池测试：分配顺序、冷却与翻倍、全部冷却时匿名请求，以及取消不计入成败
+"""
+
+import pytest
+
+import credentials
+from credentials import CredentialPool, cookie_paths
+from retry import FORBIDDEN, NETWORK, THROTTLED
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(credentials.time, "time", clock)
+    return clock
+
+
+def _write_cookie_file(path, value):
+    path.write_text(
+        "# Netscape HTTP Cookie File\n"
+        f".youtube.com\tTRUE\t/\tTRUE\t2147483647\tSID\t{value}\n"
+    )
+    return str(path)
+
+
+@pytest.fixture
+def pool(tmp_path, clock):
+    pool = CredentialPool(cooldown=300, max_cooldown=1000)
+    paths = [_write_cookie_file(tmp_path / f"{name}.txt", name) for name in ("a", "b", "c")]
+    assert pool.load(paths) == []
+    return pool
+
+
+def test_load_skips_missing_and_invalid_files(tmp_path):
+    bad = tmp_path / "bad.txt"
+    bad.write_text("not a cookie file\n")
+    good = _write_cookie_file(tmp_path / "good.txt", "x")
+    pool = CredentialPool()
+    errors = pool.load([good, good, str(tmp_path / "missing.txt"), str(bad)])
+    assert len(errors) == 1
+    assert [i["name"] for i in pool.snapshot()["identities"]] == ["good.txt"]
+
+
+def test_round_robin_when_no_failures(pool):
+    names = []
+    for _ in range(6):
+        identity = pool.acquire()
+        names.append(identity.name)
+        pool.release(identity)
+    assert names == ["a.txt", "b.txt", "c.txt"] * 2
+
+
+def test_least_recent_failure_first(pool, clock):
+    a, b, c = pool.acquire(), pool.acquire(), pool.acquire()
+    pool.release(a, THROTTLED)
+    pool.release(b)
+    pool.release(c)
+    clock.now += 301
+    # a 冷却结束，但最近失败过，排在从未失败的身份之后；b、c 之间轮询
+    names = []
+    for _ in range(4):
+        identity = pool.acquire()
+        names.append(identity.name)
+        pool.release(identity)
+    assert names == ["b.txt", "c.txt", "b.txt", "c.txt"]
+
+
+def test_non_blocking_failure_does_not_bench(pool):
+    identity = pool.acquire()
+    pool.release(identity, NETWORK)
+    assert identity.failures == 1
+    assert identity.last_failure == 0.0
+    assert pool.available() == 3
+
+
+def test_bench_and_cooldown_doubling(pool, clock):
+    identities = {}
+    for _ in range(3):
+        identity = pool.acquire()
+        identities[identity.name] = identity
+    a = identities["a.txt"]
+    pool.release(identities["b.txt"])
+    pool.release(identities["c.txt"])
+
+    pool.release(a, THROTTLED)
+    assert a.benched_until == clock.now + 300
+    assert pool.available() == 2
+
+    clock.now += 301
+    assert pool.available() == 3
+    a.in_use += 1
+    pool.release(a, FORBIDDEN)
+    assert a.benched_until == clock.now + 600
+
+    clock.now += 601
+    a.in_use += 1
+    pool.release(a, FORBIDDEN)
+    # 翻倍后不超过 max_cooldown
+    assert a.benched_until == clock.now + 1000
+
+    a.in_use += 1
+    pool.release(a)
+    assert a.strikes == 0
+
+
+def test_anonymous_when_all_benched(pool, clock):
+    for _ in range(3):
+        pool.release(pool.acquire(), THROTTLED)
+    assert pool.acquire() is None
+    snapshot = pool.snapshot()
+    assert snapshot["available"] == 0
+    assert snapshot["anonymous_requests"] == 1
+
+    clock.now += 301
+    assert pool.acquire() is not None
+
+
+def test_cancelled_release_is_neutral(pool):
+    identity = pool.acquire()
+    pool.release(identity, THROTTLED)
+    strikes, successes, failures = identity.strikes, identity.successes, identity.failures
+
+    identity.in_use += 1
+    pool.release(identity, cancelled=True)
+    assert identity.in_use == 0
+    assert (identity.strikes, identity.successes, identity.failures) == (strikes, successes, failures)
+
+
+def test_release_anonymous_is_noop(pool):
+    pool.release(None, THROTTLED)
+    pool.release(None, cancelled=True)
+
+
+def test_cookie_paths_include_directory(tmp_path):
+    cookie_dir = tmp_path / "cookies"
+    cookie_dir.mkdir()
+    (cookie_dir / "b.txt").write_text("")
+    (cookie_dir / "a.txt").write_text("")
+    (cookie_dir / "notes.md").write_text("")
+    paths = cookie_paths(["cookies.txt"], str(cookie_dir))
+    assert paths == ["cookies.txt", str(cookie_dir / "a.txt"), str(cookie_dir / "b.txt")]
+
+
+def test_acquire_prefers_given_identity_unless_benched(pool, clock):
+    a = pool.acquire()
+    pool.release(a)
+    # 按轮询下一个应是 b，指定 a 时沿用 a
+    assert pool.acquire(prefer=a) is a
+    pool.release(a, THROTTLED)
+    assert pool.acquire(prefer=a).name == "b.txt"
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+分段转码测试：只有全部切分点都落在静音中时才分段；进程组取消时终止 ffmpeg（不需要 ffmpeg）
+"""
+
+import subprocess
+import sys
+
+import encoding
+
+
+def _fake_transcode(calls):
+    def transcode(src_path, dst_path, audio_ext, profile=None, **kwargs):
+        calls.append((src_path, dst_path, audio_ext, profile))
+    return transcode
+
+
+def test_plan_segments_requires_silence_at_every_boundary(monkeypatch):
+    monkeypatch.setattr(encoding, "_find_boundary", lambda src, target: target + 1.5)
+    assert encoding.plan_segments("src.opus", 3600, 3) == [(0.0, 1201.5), (1201.5, 2401.5), (2401.5, 3600)]
+
+    monkeypatch.setattr(encoding, "_find_boundary", lambda src, target: None if target > 2000 else target)
+    assert encoding.plan_segments("src.opus", 3600, 3) is None
+
+
+def test_transcode_segmented_falls_back_without_silence(monkeypatch):
+    calls = []
+    monkeypatch.setattr(encoding, "transcode", _fake_transcode(calls))
+    monkeypatch.setattr(encoding, "_find_boundary", lambda src, target: None)
+    assert encoding.transcode_segmented("src.opus", "out.mp3", "mp3", "default", workers=4, duration=3600) is False
+    assert calls == [("src.opus", "out.mp3", "mp3", "default")]
+
+
+def test_transcode_segmented_short_audio_is_single_pass(monkeypatch):
+    calls = []
+    monkeypatch.setattr(encoding, "transcode", _fake_transcode(calls))
+    monkeypatch.setattr(encoding, "_find_boundary", lambda src, target: target)
+    assert encoding.transcode_segmented("src.opus", "out.mp3", "mp3", workers=4, duration=90) is False
+    assert len(calls) == 1
+
+
+def _sleeper():
+    return subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+
+
+def test_process_group_kills_running_and_later_processes():
+    group = encoding.ProcessGroup()
+    proc = _sleeper()
+    group.add(proc)
+    group.kill()
+    assert proc.wait(timeout=10) != 0
+
+    # 取消之后才启动的进程立即终止
+    late = _sleeper()
+    group.add(late)
+    assert late.wait(timeout=10) != 0
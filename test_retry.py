@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+错误分类和 yt-dlp 重试等待函数测试
+"""
+
+import threading
+import urllib.error
+
+import pytest
+from yt_dlp.utils import DownloadError, ExtractorError, RetryManager
+
+import app
+from retry import EXTRACTOR, FATAL, FORBIDDEN, NETWORK, RETRY_POLICIES, THROTTLED, UNKNOWN, classify_error
+
+
+def _http_error(code):
+    return urllib.error.HTTPError("https://example.com", code, "error", {}, None)
+
+
+def test_classify_http_status():
+    assert classify_error(_http_error(429)) == THROTTLED
+    assert classify_error(_http_error(403)) == FORBIDDEN
+    assert classify_error(_http_error(503)) == NETWORK
+    assert classify_error(_http_error(500)) == NETWORK
+    assert classify_error(_http_error(408)) == NETWORK
+
+
+def test_classify_server_error_message():
+    assert classify_error(DownloadError("ERROR: unable to download video data: HTTP Error 503: Service Unavailable")) == NETWORK
+    assert classify_error(DownloadError("ERROR: HTTP Error 502: Bad Gateway")) == NETWORK
+    assert classify_error(DownloadError("ERROR: HTTP Error 408: Request Timeout")) == NETWORK
+
+
+def test_classify_fatal_only_when_matched():
+    assert classify_error(DownloadError("ERROR: [youtube] abc: Video unavailable")) == FATAL
+    assert classify_error(ExtractorError("Unable to extract player response")) == EXTRACTOR
+    # 无法识别的错误仍然可以重试
+    unknown = classify_error(RuntimeError("something odd happened"))
+    assert unknown == UNKNOWN
+    assert RETRY_POLICIES[unknown].max_attempts > 1
+
+
+def test_network_retry_sleep_called_by_report_retry(monkeypatch):
+    sleeps = []
+    warnings = []
+    monkeypatch.setattr("yt_dlp.utils._utils.time.sleep", sleeps.append)
+    sleep_func = app._build_ydl_opts("%(id)s.%(ext)s", [])["retry_sleep_functions"]["http"]
+
+    for count in (1, 2, 3):
+        RetryManager.report_retry(
+            _http_error(503), count, 5, sleep_func=sleep_func, info=lambda msg: None, warn=warnings.append,
+        )
+
+    policy = RETRY_POLICIES[NETWORK]
+    assert len(sleeps) == 3
+    assert all(0 < delay <= policy.max_delay for delay in sleeps)
+    assert len(warnings) == 3
+
+
+def _preflight_raising(monkeypatch, exc):
+    def fail(video_url, clip=None):
+        raise exc
+    monkeypatch.setattr(app, "_preflight", fail)
+    return app._preflight_task("missing-task", "https://www.youtube.com/watch?v=abc", threading.Event())
+
+
+def test_preflight_fails_fast_only_on_matched_fatal(monkeypatch):
+    with pytest.raises(DownloadError):
+        _preflight_raising(monkeypatch, DownloadError("ERROR: [youtube] abc: Private video"))
+    info, cost, identity = _preflight_raising(monkeypatch, RuntimeError("unexpected extractor state"))
+    assert info is None
+    assert identity is None
+    assert cost == app._EST_DEFAULT_COST
+
+
+def test_stale_preflight_info_is_reextracted():
+    info = {"id": "abc"}
+    now = app._now_ts()
+    assert app._reusable_info(info, now) is info
+    assert app._reusable_info(info, now - app._PREFLIGHT_INFO_MAX_AGE - 1) is None
+    assert app._reusable_info(None, now) is None
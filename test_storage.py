@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+产物存储测试：LocalStorage、S3Storage（使用模拟 S3 / MinIO 行为的假客户端）
+以及 /artifacts 对远程存储的 Range 请求转发
+"""
+
+import hashlib
+import io
+
+import pytest
+
+import app
+from storage import LocalStorage, S3Storage
+
+
+class FakeClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+        self.closed = False
+
+    def read(self):
+        return self._stream.read()
+
+    def iter_chunks(self, chunk_size):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeS3Client:
+    """按 S3 / MinIO 的语义实现 S3Storage 用到的几个接口"""
+
+    def __init__(self):
+        self.objects = {}
+        self.range_requests = []
+
+    def upload_file(self, path, bucket, key, Config=None):
+        with open(path, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def _get(self, bucket, key):
+        if (bucket, key) not in self.objects:
+            raise FakeClientError("NoSuchKey")
+        return self.objects[(bucket, key)]
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self._get(Bucket, Key)
+        if Range:
+            self.range_requests.append(Range)
+            start, end = Range[len("bytes="):].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": FakeBody(data)}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def make_s3_storage(prefix="listentube"):
+    storage = S3Storage.__new__(S3Storage)
+    storage.bucket = "bucket"
+    storage.prefix = prefix
+    storage._client = FakeS3Client()
+    storage._transfer = None
+    storage._client_error = FakeClientError
+    return storage
+
+
+def test_local_storage_roundtrip(tmp_path):
+    storage = LocalStorage(str(tmp_path / "artifacts"))
+    src = tmp_path / "audio.mp3"
+    src.write_bytes(b"0123456789")
+
+    storage.put("abc.mp3", str(src))
+    assert not src.exists()
+    assert storage.size("abc.mp3") == 10
+    assert b"".join(storage.read_range("abc.mp3", 2, 6)) == b"2345"
+    assert storage.local_path("abc.mp3") is not None
+
+    storage.put_bytes("tasks/t1.json", b"{}")
+    assert storage.get_bytes("tasks/t1.json") == b"{}"
+    storage.delete("abc.mp3")
+    assert storage.size("abc.mp3") is None
+    assert storage.get_bytes("missing.json") is None
+
+
+def test_local_storage_rejects_traversal(tmp_path):
+    storage = LocalStorage(str(tmp_path / "artifacts"))
+    with pytest.raises(ValueError):
+        storage.put_bytes("../escape.json", b"x")
+
+
+def test_s3_storage_roundtrip(tmp_path):
+    storage = make_s3_storage()
+    src = tmp_path / "audio.mp3"
+    src.write_bytes(b"0123456789")
+
+    storage.put("abc.mp3", str(src))
+    assert ("bucket", "listentube/abc.mp3") in storage._client.objects
+    assert storage.size("abc.mp3") == 10
+    assert b"".join(storage.read_range("abc.mp3", 3, 7)) == b"3456"
+    assert storage._client.range_requests == ["bytes=3-6"]
+    assert storage.local_path("abc.mp3") is None
+
+    assert storage.get_bytes("missing.json") is None
+    assert storage.size("missing.mp3") is None
+    storage.delete("abc.mp3")
+    assert storage.size("abc.mp3") is None
+
+
+@pytest.fixture
+def remote_artifact(monkeypatch):
+    storage = make_s3_storage()
+    monkeypatch.setattr(app, "_STORAGE", storage)
+    data = bytes(range(256)) * 40
+    digest = hashlib.sha256(data).hexdigest()
+    storage.put_bytes(app._artifact_key(digest, "mp3"), data)
+    return storage, digest, data
+
+
+def test_remote_artifact_full_response(remote_artifact):
+    _, digest, data = remote_artifact
+    resp = app.app.test_client().get(f"/artifacts/{digest}.mp3")
+    assert resp.status_code == 200
+    assert resp.data == data
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert "immutable" in resp.headers["Cache-Control"]
+
+
+def test_remote_artifact_forwards_range(remote_artifact):
+    storage, digest, data = remote_artifact
+    resp = app.app.test_client().get(f"/artifacts/{digest}.mp3", headers={"Range": "bytes=100-199"})
+    assert resp.status_code == 206
+    assert resp.data == data[100:200]
+    assert resp.headers["Content-Range"] == f"bytes 100-199/{len(data)}"
+    # 只向存储请求客户端需要的区间
+    assert storage._client.range_requests[-1] == "bytes=100-199"
+
+
+def test_remote_artifact_conditional_and_unsatisfiable(remote_artifact):
+    _, digest, data = remote_artifact
+    client = app.app.test_client()
+    resp = client.get(f"/artifacts/{digest}.mp3", headers={"If-None-Match": f'"{digest}"'})
+    assert resp.status_code == 304
+    resp = client.get(f"/artifacts/{digest}.mp3", headers={"Range": f"bytes={len(data) + 10}-"})
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == f"bytes */{len(data)}"
+
+
+def test_store_artifact_removes_local_copy(remote_artifact, tmp_path):
+    storage, _, _ = remote_artifact
+    src = tmp_path / "audio.out.mp3"
+    src.write_bytes(b"encoded audio")
+    digest = app._store_artifact(str(src), "mp3")
+    assert not src.exists()
+    assert storage.size(app._artifact_key(digest, "mp3")) == len(b"encoded audio")
+
+    # 已有相同内容时同样删除本地文件
+    src.write_bytes(b"encoded audio")
+    app._store_artifact(str(src), "mp3")
+    assert not src.exists()
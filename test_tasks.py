@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+任务生命周期测试：片段下载参数、取消时终止 ffmpeg 进程、预检身份沿用、调度顺序和预热让出
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from http.cookiejar import Cookie
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from credentials import CredentialPool, Identity
+from encoding import ProcessGroup
+from retry import FATAL, classify_error
+from storage import LocalStorage
+
+
+class FakeCookieJar:
+    def __init__(self, cookies):
+        self.cookies = cookies
+
+    def get_cookies_for_url(self, url):
+        return self.cookies
+
+
+class FakeYDL:
+    def __init__(self, cookies=()):
+        self.cookiejar = FakeCookieJar(list(cookies))
+
+
+def _cookie(name, value):
+    return Cookie(0, name, value, None, False, ".youtube.com", True, True, "/", True,
+                  True, None, False, None, None, {})
+
+
+def test_download_clip_requests_only_the_range(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "run_ffmpeg", lambda args, group=None: calls.append((args, group)))
+    info = {
+        "duration": 3600,
+        "url": "https://media.example.com/audio.webm",
+        "acodec": "opus",
+        "http_headers": {"User-Agent": "test"},
+    }
+    group = ProcessGroup()
+    clip_state = {}
+    path = app._download_clip(FakeYDL([_cookie("SID", "abc")]), info, (60, 180), str(tmp_path),
+                              str(tmp_path / "ffmpeg.progress"), clip_state, group)
+
+    args, used_group = calls[0]
+    assert used_group is group
+    assert clip_state["duration"] == 120
+    assert args[args.index("-ss") + 1] == "60"
+    assert args[args.index("-t") + 1] == "120"
+    assert args.index("-ss") < args.index("-i")
+    assert args[args.index("-i") + 1] == info["url"]
+    assert "User-Agent: test\r\n" in args[args.index("-headers") + 1]
+    assert args[args.index("-cookies") + 1].startswith("SID=abc;")
+    assert args[-1] == path
+
+
+def test_download_clip_picks_audio_format_and_open_end(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "run_ffmpeg", lambda args, group=None: calls.append(args))
+    info = {
+        "duration": None,
+        "requested_formats": [
+            {"url": "https://media.example.com/video.mp4", "acodec": "none"},
+            {"url": "https://media.example.com/audio.m4a", "acodec": "mp4a.40.2"},
+        ],
+    }
+    clip_state = {}
+    app._download_clip(FakeYDL(), info, (30, None), str(tmp_path), str(tmp_path / "p"), clip_state)
+    args = calls[0]
+    assert clip_state["duration"] is None
+    assert "-t" not in args
+    assert args[args.index("-i") + 1] == "https://media.example.com/audio.m4a"
+
+
+def test_download_clip_rejects_start_beyond_duration(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "run_ffmpeg", lambda args, group=None: pytest.fail("ffmpeg should not run"))
+    with pytest.raises(ValueError):
+        app._download_clip(FakeYDL(), {"duration": 100, "url": "https://x"}, (100, None), str(tmp_path),
+                           str(tmp_path / "p"), {})
+
+
+def test_cancel_kills_task_processes(monkeypatch):
+    task_id = "task-cancel-procs"
+    group = ProcessGroup()
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    group.add(proc)
+    monkeypatch.setitem(app._TASKS, task_id, {"id": task_id, "status": "downloading"})
+    monkeypatch.setitem(app._CANCEL_EVENTS, task_id, threading.Event())
+    monkeypatch.setitem(app._TASK_PROCESSES, task_id, group)
+
+    assert app._cancel_task(task_id, "test")
+    assert proc.wait(timeout=10) != 0
+    assert app._CANCEL_EVENTS[task_id].is_set()
+    assert app._TASKS[task_id]["status"] == "cancelled"
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(app, "_SCHED_QUEUE", {})
+    monkeypatch.setattr(app, "_SCHED_RUNNING", {})
+    monkeypatch.setattr(app, "_MAX_CONCURRENT_TASKS", 2)
+    monkeypatch.setattr(app, "_LONG_JOB_SLOTS", 1)
+    monkeypatch.setattr(app, "_SCHED_AGING_FACTOR", 1.0)
+    return app._SCHED_QUEUE, app._SCHED_RUNNING
+
+
+def _entry(cost, enqueued_at):
+    return {"cost": cost, "long": cost > app._LONG_JOB_SECONDS, "enqueued_at": enqueued_at}
+
+
+def test_sched_pick_shortest_job_first(scheduler):
+    queue, _ = scheduler
+    queue.update({"long": _entry(100, 1000), "short": _entry(10, 1000), "medium": _entry(50, 1000)})
+    assert app._sched_pick(1000) == "short"
+
+
+def test_sched_pick_aging_overtakes_short_job(scheduler):
+    queue, _ = scheduler
+    # 等待了 200 秒的 100 秒任务排在刚进来的 10 秒任务之前
+    queue.update({"old": _entry(100, 800), "new": _entry(10, 1000)})
+    assert app._sched_pick(1000) == "old"
+
+
+def test_sched_pick_keeps_slot_for_short_jobs(scheduler):
+    queue, running = scheduler
+    running["running-long"] = True
+    queue["waiting-long"] = _entry(app._LONG_JOB_SECONDS * 5, 0)
+    assert app._sched_pick(1000) is None
+    queue["waiting-short"] = _entry(10, 1000)
+    assert app._sched_pick(1000) == "waiting-short"
+
+
+def test_acquire_slot_long_job_cap(scheduler):
+    _, running = scheduler
+    long_cost = app._LONG_JOB_SECONDS * 5
+    assert app._acquire_slot("long-1", long_cost, threading.Event())
+    assert running == {"long-1": True}
+
+    cancel = threading.Event()
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(ok=app._acquire_slot("long-2", long_cost, cancel)))
+    waiter.start()
+    waiter.join(timeout=0.3)
+    assert waiter.is_alive()
+
+    # 剩下的槽位留给短任务
+    assert app._acquire_slot("short-1", 10, threading.Event())
+    cancel.set()
+    waiter.join(timeout=5)
+    assert result == {"ok": False}
+    app._release_slot("long-1")
+    app._release_slot("short-1")
+    assert running == {}
+
+
+def test_estimate_cost(monkeypatch):
+    monkeypatch.setattr(app, "_TRANSCODE_WORKERS", 4)
+    assert app._estimate_cost(None, None) == app._EST_DEFAULT_COST
+    short = app._estimate_cost(60, None)
+    expected = (app._EST_OVERHEAD_SECONDS + 60 * app._EST_AUDIO_BYTES_PER_SECOND / app._EST_DOWNLOAD_BYTES_PER_SECOND
+                + 60 * app._EST_ENCODE_RATIO)
+    assert short == pytest.approx(expected)
+    # 只有大小时按码率推算时长
+    assert app._estimate_cost(None, 60 * app._EST_AUDIO_BYTES_PER_SECOND) == pytest.approx(expected)
+    # 长音频分段并行转码，编码时间按进程数折算
+    hours = 3 * 3600
+    long = app._estimate_cost(hours, None)
+    assert long == pytest.approx(app._EST_OVERHEAD_SECONDS
+                                 + hours * app._EST_AUDIO_BYTES_PER_SECOND / app._EST_DOWNLOAD_BYTES_PER_SECOND
+                                 + hours * app._EST_ENCODE_RATIO / 4)
+    assert short < long
+
+
+def test_first_attempt_reuses_preflight_identity(tmp_path, monkeypatch):
+    pool = CredentialPool()
+    a, b = Identity("a.txt", "a", []), Identity("b.txt", "b", [])
+    pool._identities = [a, b]
+    monkeypatch.setattr(app, "_CREDENTIALS", pool)
+    seen = []
+
+    def fake_download(video_url, audio_ext, temp_dir, hooks, identity=None, info=None, **kwargs):
+        seen.append((identity, info))
+        return os.path.join(temp_dir, "audio.out.mp3"), "title"
+
+    monkeypatch.setattr(app, "_download_audio", fake_download)
+    info = {"id": "abc"}
+    # 预检用的是 a；按轮询下一个本应分配 a 之后的 b
+    pool.release(pool.acquire())
+    app._download_with_retries("task-identity", "https://identity.example.com/v", "mp3", str(tmp_path),
+                               threading.Event(), info=info, info_identity=a)
+    assert seen == [(a, info)]
+
+    # 预检身份已进入冷却：换身份并重新解析
+    a.benched_until = float("inf")
+    app._download_with_retries("task-identity", "https://identity.example.com/v", "mp3", str(tmp_path),
+                               threading.Event(), info=info, info_identity=a)
+    assert seen[1] == (b, None)
+
+
+def test_clip_start_beyond_duration_fails_without_slot(monkeypatch):
+    task_id = "task-clip-beyond"
+    monkeypatch.setattr(app, "_preflight", lambda url, clip=None: ({"duration": 100}, 0.0, 0, None))
+    monkeypatch.setattr(app, "_acquire_slot", lambda *args: pytest.fail("must not wait for a slot"))
+    monkeypatch.setitem(app._TASKS, task_id, {"id": task_id, "status": "queued"})
+    monkeypatch.setitem(app._CANCEL_EVENTS, task_id, threading.Event())
+
+    app._run_download_task(task_id, "https://clip-beyond.example.com/v", "mp3", clip=(150, None))
+    task = app._TASKS[task_id]
+    assert task["status"] == "error"
+    assert task["error"] == "clip start 150s is beyond the video duration 100s"
+    assert classify_error(ValueError(task["error"])) == FATAL
+
+
+def test_prewarm_watcher_kills_transcode_on_user_work(monkeypatch):
+    monkeypatch.setattr(app, "_PREWARM_YIELD_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(app, "_has_user_work", lambda: True)
+    group = ProcessGroup()
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    group.add(proc)
+    app._watch_prewarm(group, threading.Event())
+    assert group.killed
+    assert proc.wait(timeout=10) != 0
+
+
+def test_prewarm_budget_measures_local_disks_only(monkeypatch):
+    checked = []
+
+    def disk_usage(path):
+        checked.append(path)
+        return SimpleNamespace(total=0, used=0, free=free[0])
+
+    free = [app._PREWARM_MIN_FREE_BYTES + 1]
+    monkeypatch.setattr(app.os, "getloadavg", lambda: (0.0, 0.0, 0.0))
+    monkeypatch.setattr(app.shutil, "disk_usage", disk_usage)
+    monkeypatch.setattr(app, "_ARTIFACTS", {"big": {"size": app._PREWARM_DISK_BUDGET_BYTES, "ext": "mp3"}})
+
+    # 远端存储的产物不占本机磁盘，只检查预热写入的临时目录
+    monkeypatch.setattr(app, "_STORAGE", object())
+    assert app._prewarm_budget_ok()
+    assert checked == [tempfile.gettempdir()]
+    free[0] = app._PREWARM_MIN_FREE_BYTES
+    assert not app._prewarm_budget_ok()
+
+    # 本地存储时产物总大小计入预算
+    monkeypatch.setattr(app, "_STORAGE", LocalStorage(tempfile.gettempdir()))
+    free[0] = app._PREWARM_MIN_FREE_BYTES + 1
+    assert not app._prewarm_budget_ok()
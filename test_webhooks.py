@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+完成回调测试：回调地址校验、对端地址检查和重定向处理
+"""
+
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import webhooks
+from webhooks import UnsafeCallbackAddress, WebhookDispatcher, is_public_address, valid_callback_url
+
+
+def _fake_resolver(mapping):
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in mapping:
+            raise socket.gaierror("unknown host")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port)) for address in mapping[host]]
+    return getaddrinfo
+
+
+@pytest.mark.parametrize("address", [
+    "127.0.0.1", "10.1.2.3", "172.16.0.1", "192.168.1.1", "169.254.169.254",
+    "100.64.0.1", "0.0.0.0", "224.0.0.1", "240.0.0.1", "::1", "fe80::1", "fc00::1", "::ffff:127.0.0.1",
+])
+def test_non_public_addresses(address):
+    assert not is_public_address(address)
+
+
+def test_public_addresses():
+    assert is_public_address("93.184.216.34")
+    assert is_public_address("2606:2800:220:1:248:1893:25c8:1946")
+
+
+def test_valid_callback_url_resolves_host(monkeypatch):
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", _fake_resolver({
+        "hooks.example.com": ["93.184.216.34"],
+        "metadata.internal": ["169.254.169.254"],
+        "mixed.example.com": ["93.184.216.34", "10.0.0.5"],
+        "127.0.0.1": ["127.0.0.1"],
+    }))
+    assert valid_callback_url("https://hooks.example.com/listentube")
+    assert not valid_callback_url("http://metadata.internal/latest/meta-data/")
+    assert not valid_callback_url("https://mixed.example.com/hook")
+    assert not valid_callback_url("http://127.0.0.1:8080/hook")
+    assert not valid_callback_url("https://unknown.example.com/hook")
+    assert not valid_callback_url("ftp://hooks.example.com/hook")
+
+
+def test_valid_callback_url_allowlist(monkeypatch):
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", _fake_resolver({}))
+    allowed = frozenset({"hooks.internal"})
+    assert valid_callback_url("http://hooks.internal:8080/hook", allowed)
+    assert valid_callback_url("http://HOOKS.internal/hook", allowed)
+    assert not valid_callback_url("https://hooks.example.com/hook", allowed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.paths.append(self.path)
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/target")
+        else:
+            self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = HTTPServer(("127.0.0.1", 0), _Handler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_post_rejects_private_peer(local_server):
+    dispatcher = WebhookDispatcher("secret", workers=0)
+    url = f"http://127.0.0.1:{local_server.server_port}/hook"
+    with pytest.raises(UnsafeCallbackAddress):
+        dispatcher._post(url, [{"status": "finished"}])
+    assert local_server.paths == []
+
+
+def test_post_allowed_host_does_not_follow_redirect(local_server):
+    dispatcher = WebhookDispatcher("secret", workers=0, allowed_hosts={"127.0.0.1"})
+    base = f"http://127.0.0.1:{local_server.server_port}"
+    assert dispatcher._post(base + "/hook", [{"status": "finished"}])
+    with pytest.raises(ValueError):
+        dispatcher._post(base + "/redirect", [{"status": "finished"}])
+    assert local_server.paths == ["/hook", "/redirect"]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+ListenTube 完成回调
+
+任务结束（完成、失败或取消）时向创建任务时提供的 callback_url 发送签名的 HTTP POST，
+调用方不再需要轮询 GET /tasks/<id>。
+
+- 发送由少量后台线程完成，下载线程只负责入队，慢速的接收方不会阻塞下载
+- 同一个 URL 的事件在 batch_window 秒内合并为一次请求：{"events": [...]}
+- 同一个 URL 同时只有一个请求在发送，事件按入队顺序送达
+- 失败时按 retry.backoff_delay 指数退避重试，4xx（408/429 除外）视为接收方拒绝，不再重试
+- 只向公网地址发送：创建任务时解析域名，连接建立后再检查对端地址（防止 DNS 重绑定），
+  不跟随重定向、不经过代理；allowed_hosts 中的主机名视为可信，不做地址检查
+
+签名：请求头 X-ListenTube-Timestamp 为 Unix 时间戳，X-ListenTube-Signature 为
+"sha256=" + HMAC-SHA256(secret, "<timestamp>.<body>") 的十六进制值。
+"""
+
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from urllib.parse import urlparse
+
+from retry import RetryPolicy, backoff_delay
+
+SIGNATURE_HEADER = "X-ListenTube-Signature"
+TIMESTAMP_HEADER = "X-ListenTube-Timestamp"
+USER_AGENT = "ListenTube-Webhook/1.0"
+
+DEFAULT_POLICY = RetryPolicy(max_attempts=8, base_delay=2.0, max_delay=300.0)
+
+
+class UnsafeCallbackAddress(ValueError):
+    """回调地址解析到回环、内网、链路本地等非公网地址"""
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    if ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved \
+            or ip.is_multicast or ip.is_unspecified:
+        return False
+    return ip.is_global
+
+
+def _resolves_to_public(host: str, port: int) -> bool:
+    """域名的所有解析结果都必须是公网地址，解析失败视为不可用"""
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return False
+    return bool(infos) and all(is_public_address(info[4][0]) for info in infos)
+
+
+def valid_callback_url(url: str, allowed_hosts=()) -> bool:
+    """allowed_hosts 非空时只接受其中的主机名；否则要求主机名解析到公网地址"""
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        return host in allowed_hosts
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return False
+    return _resolves_to_public(host, port)
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    message = timestamp.encode("ascii") + b"." + body
+    return "sha256=" + hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def _check_peer(sock):
+    address = sock.getpeername()[0]
+    if not is_public_address(address):
+        sock.close()
+        raise UnsafeCallbackAddress(f"callback resolved to non-public address {address}")
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        super().connect()
+        _check_peer(self.sock)
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _check_peer(self.sock)
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """不跟随重定向，3xx 以 HTTPError 返回给调用方"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_PUBLIC_OPENER = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _NoRedirect, _PublicHTTPHandler, _PublicHTTPSHandler,
+)
+_TRUSTED_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}), _NoRedirect)
+
+
+class _Receiver:
+    """一个回调地址的待发送事件"""
+
+    def __init__(self):
+        self.events = deque()
+        self.ready_at = 0.0  # 最早可以发送的时间：首个事件入队后等待合并，失败后等待退避
+        self.attempts = 0
+        self.in_flight = False
+
+
+class WebhookDispatcher:
+    def __init__(self, secret: str, workers: int = 2, batch_window: float = 1.0, max_batch: int = 50,
+                 timeout: float = 10.0, policy: RetryPolicy = DEFAULT_POLICY, allowed_hosts=()):
+        self.secret = secret
+        self.allowed_hosts = frozenset(h.lower() for h in allowed_hosts)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.policy = policy
+        self._cond = threading.Condition()
+        self._receivers = {}  # url -> _Receiver
+        self._stats = {"delivered": 0, "requests": 0, "retries": 0, "dropped": 0}
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def enqueue(self, url: str, event: dict):
+        with self._cond:
+            receiver = self._receivers.get(url)
+            if receiver is None:
+                receiver = self._receivers[url] = _Receiver()
+            if not receiver.events and not receiver.attempts:
+                receiver.ready_at = time.time() + self.batch_window
+            receiver.events.append(event)
+            self._cond.notify()
+
+    def _next_batch(self):
+        """等待并取出一个可以发送的批次，返回 (url, events)"""
+        with self._cond:
+            while True:
+                now = time.time()
+                wait = None
+                for url, receiver in self._receivers.items():
+                    if receiver.in_flight or not receiver.events:
+                        continue
+                    if receiver.ready_at <= now:
+                        receiver.in_flight = True
+                        events = list(receiver.events)[:self.max_batch]
+                        return url, events
+                    delay = receiver.ready_at - now
+                    wait = delay if wait is None else min(wait, delay)
+                self._cond.wait(wait)
+
+    def _post(self, url: str, events: list) -> bool:
+        """发送一个批次，返回 False 表示可以重试；接收方明确拒绝或地址不安全时抛出 ValueError"""
+        body = json.dumps({"events": events}, ensure_ascii=False).encode("utf-8")
+        timestamp = str(int(time.time()))
+        req = urllib.request.Request(url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "User-Agent": USER_AGENT,
+            TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign(self.secret, timestamp, body),
+        })
+        host = (urlparse(url).hostname or "").lower()
+        opener = _TRUSTED_OPENER if host in self.allowed_hosts else _PUBLIC_OPENER
+        try:
+            with opener.open(req, timeout=self.timeout) as resp:
+                resp.read()
+            return True
+        except urllib.error.HTTPError as exc:
+            if 300 <= exc.code < 400:
+                raise ValueError(f"receiver redirected webhook: HTTP {exc.code}") from exc
+            if 400 <= exc.code < 500 and exc.code not in (408, 429):
+                raise ValueError(f"receiver rejected webhook: HTTP {exc.code}") from exc
+            return False
+        except (urllib.error.URLError, OSError):
+            return False
+
+    def _worker(self):
+        while True:
+            url, events = self._next_batch()
+            try:
+                delivered = self._post(url, events)
+                rejected = False
+            except ValueError:
+                delivered = False
+                rejected = True
+            with self._cond:
+                self._stats["requests"] += 1
+                receiver = self._receivers[url]
+                receiver.in_flight = False
+                receiver.attempts += 1
+                if delivered or rejected or receiver.attempts >= self.policy.max_attempts:
+                    for _ in events:
+                        receiver.events.popleft()
+                    self._stats["delivered" if delivered else "dropped"] += len(events)
+                    receiver.attempts = 0
+                    receiver.ready_at = time.time()
+                    if not receiver.events:
+                        del self._receivers[url]
+                else:
+                    self._stats["retries"] += 1
+                    receiver.ready_at = time.time() + backoff_delay(self.policy, receiver.attempts)
+                self._cond.notify()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            pending = sum(len(r.events) for r in self._receivers.values())
+            retrying = sum(1 for r in self._receivers.values() if r.attempts)
+            return dict(self._stats, pending=pending, retrying_receivers=retrying)